@@ -3,19 +3,75 @@ import numpy as np
 import tensorflow as tf
 from PIL import Image
 import os
+import json
 import plotly.graph_objects as go
 import plotly.express as px
-from skin_disease_model import SkinDiseaseDetector
+from skin_disease_model import SkinDiseaseDetector, check_image_quality
+from inference_gate import InferenceGate, GateRejected
+from model_registry import ModelRegistry
 import warnings
 warnings.filterwarnings('ignore')
 import requests
 import shutil
+from model_package import sync_package, download_file
 
 MODEL_URL = "https://www.dropbox.com/scl/fi/5wwmx63gw24afr15hxhid/skin_disease_model.h5?rlkey=we18mf6adx26eeh6hkmqss4a6&st=c1o0j81k&dl=1"
 MODEL_PATH = "skin_disease_model.h5"
 TEMP_MODEL_PATH = "skin_disease_model.h5?dl=1"
+# Versioned model package (see model_package.py); when set, only changed chunks are downloaded
+MODEL_PACKAGE_URL = ""
+MODEL_PACKAGE_DIR = "model_package"
+# Compressed float16 artifact (see `python model_package.py compress`); used instead of the H5 file when set
+MODEL_ARTIFACT_URL = ""
+MODEL_ARTIFACT_PATH = "skin_disease_model.f16.zst"
+# How often the background watcher looks for a new model version on disk
+MODEL_POLL_SECONDS = 30
+# Create this file (e.g. `touch rollback_model`) to switch back to the previously served version
+ROLLBACK_MARKER_PATH = "rollback_model"
+
+# Inference admission control (shared by all sessions of this process)
+INFERENCE_MAX_IN_FLIGHT = 1
+INFERENCE_MAX_QUEUE = 8
+INFERENCE_DEADLINE_SECONDS = 20
+# Latency target used to fall back to cheaper model variants under load
+LATENCY_SLO_SECONDS = 3.0
+# Optional distilled model answering first; the full model runs only below the threshold
+FAST_MODEL_PATH = "skin_disease_student.h5"
+CASCADE_THRESHOLD = 0.8
+# Live metrics appended by `python skin_disease_model.py train --telemetry ...`
+TELEMETRY_PATH = "training_telemetry.jsonl"
+# Compute precision for serving; "bfloat16" uses AVX-512 BF16 / AMX on recent Xeons
+INFERENCE_PRECISION = "float32"
+# Head-only update published by `python skin_disease_model.py add-classes`
+HEAD_UPDATE_PATH = "skin_disease_head.h5"
+# Monte-Carlo dropout samples per request (0 disables) and the triage threshold
+MC_DROPOUT_SAMPLES = 20
+UNCERTAINTY_THRESHOLD = 0.5
+# Coarse head computed from the same backbone pass as the diagnosis
+MALIGNANCY_GROUPS = {
+    "Malignant or pre-malignant": [
+        "Actinic Keratosis and Malignant Lesions",
+        "Melanoma and Skin Cancer",
+    ],
+}
 
 def download_model():
+    if MODEL_PACKAGE_URL:
+        try:
+            downloaded, total = sync_package(MODEL_PACKAGE_URL, MODEL_PACKAGE_DIR)
+            st.info(f"Model package synced: {downloaded / (1024*1024):.1f} of {total / (1024*1024):.1f} MB downloaded.")
+        except Exception as e:
+            st.error(f"Failed to sync model package: {e}")
+        return
+    if MODEL_ARTIFACT_URL:
+        if not os.path.exists(MODEL_ARTIFACT_PATH):
+            try:
+                elapsed = download_file(MODEL_ARTIFACT_URL, MODEL_ARTIFACT_PATH)
+                size = os.path.getsize(MODEL_ARTIFACT_PATH) / (1024*1024)
+                st.info(f"Compressed model downloaded: {size:.1f} MB in {elapsed:.1f}s.")
+            except Exception as e:
+                st.error(f"Failed to download compressed model: {e}")
+        return
     if not os.path.exists(MODEL_PATH):
         try:
             st.info("Downloading model from Dropbox...")
@@ -33,6 +89,11 @@ def download_model():
 
 download_model()
 
+if MODEL_PACKAGE_URL and os.path.exists(os.path.join(MODEL_PACKAGE_DIR, "manifest.json")):
+    MODEL_PATH = MODEL_PACKAGE_DIR
+elif MODEL_ARTIFACT_URL and os.path.exists(MODEL_ARTIFACT_PATH):
+    MODEL_PATH = MODEL_ARTIFACT_PATH
+
 if not os.path.exists(MODEL_PATH):
     st.error("Model file was not downloaded. Please check the Dropbox link or network connection.")
 else:
@@ -77,22 +138,60 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+def build_detector(model_path):
+    """Load a model version and prepare it for serving"""
+    detector = SkinDiseaseDetector()
+    detector.get_class_names('class_names.txt')
+    detector.load_model(model_path, precision=INFERENCE_PRECISION)
+    if os.path.exists(HEAD_UPDATE_PATH):
+        detector.apply_head_update(HEAD_UPDATE_PATH)
+    detector.split_model()
+    detector.add_grouped_head('malignancy', MALIGNANCY_GROUPS, other="Benign")
+    detector.enable_uncertainty(MC_DROPOUT_SAMPLES)
+    if os.path.exists(FAST_MODEL_PATH):
+        detector.enable_cascade(FAST_MODEL_PATH, threshold=CASCADE_THRESHOLD)
+    detector.enable_load_adaptive(
+        latency_slo=LATENCY_SLO_SECONDS,
+        max_in_flight=INFERENCE_MAX_IN_FLIGHT
+    )
+    return detector
+
 @st.cache_resource
+def get_model_registry():
+    """Registry that hot-swaps new model versions in the background"""
+    refresh = None
+    if MODEL_PACKAGE_URL:
+        refresh = lambda: sync_package(MODEL_PACKAGE_URL, MODEL_PACKAGE_DIR)
+    return ModelRegistry(
+        build_detector,
+        MODEL_PATH,
+        poll_interval=MODEL_POLL_SECONDS,
+        refresh=refresh,
+        watch=[HEAD_UPDATE_PATH],
+        rollback_marker=ROLLBACK_MARKER_PATH
+    ).start()
+
 def load_model():
     """Load the trained model"""
     try:
-        detector = SkinDiseaseDetector()
-        detector.get_class_names('class_names.txt')
-        detector.load_model(MODEL_PATH)
-        return detector
+        return get_model_registry().current()
     except Exception as e:
         st.error(f"Model not found or failed to load. Error: {e}")
         return None
 
 # After download_model() and model file presence check
-if os.path.exists(MODEL_PATH):
+if os.path.isfile(MODEL_PATH):
     st.write(f"Model file size: {os.path.getsize(MODEL_PATH) / (1024*1024):.2f} MB")
 
+@st.cache_resource
+def get_inference_gate():
+    """Inference gate shared by every session"""
+    return InferenceGate(
+        max_in_flight=INFERENCE_MAX_IN_FLIGHT,
+        max_queue=INFERENCE_MAX_QUEUE,
+        deadline=INFERENCE_DEADLINE_SECONDS
+    )
+
 def preprocess_image(image):
     """Preprocess uploaded image"""
     # Convert to RGB if needed
@@ -108,6 +207,71 @@ def preprocess_image(image):
     
     return img_array
 
+def read_telemetry(path):
+    """Records appended to the telemetry file since this session last read it"""
+    state = st.session_state.setdefault('telemetry', {'path': path, 'offset': 0, 'records': []})
+    if not os.path.exists(path):
+        return []
+    # Start over when the file was switched, truncated or replaced
+    if state['path'] != path or os.path.getsize(path) < state['offset']:
+        state.update(path=path, offset=0, records=[])
+    with open(path, 'rb') as f:
+        f.seek(state['offset'])
+        data = f.read()
+    # A line still being written has no newline yet; leave it for the next read
+    complete = data[:data.rfind(b'\n') + 1]
+    state['offset'] += len(complete)
+    state['records'].extend(json.loads(line) for line in complete.splitlines() if line.strip())
+    return state['records']
+
+def show_training_monitor():
+    """Plot the latest run recorded in the telemetry file"""
+    st.header("📉 Training Monitor")
+    path = st.text_input("Telemetry file", TELEMETRY_PATH)
+    st.button("Refresh")
+    records = read_telemetry(path)
+    starts = [i for i, record in enumerate(records) if record['type'] == 'start']
+    if not starts:
+        st.info(f"No training run recorded in {path} yet.")
+        return
+    run = records[starts[-1]:]
+    batches = [record for record in run if record['type'] == 'batch']
+    epochs = [record for record in run if record['type'] == 'epoch']
+    last = run[-1]
+    
+    status = ""
+    if last['type'] == 'run_end':
+        status = " · stopped, resume with --resume" if last.get('stopped') else " · finished"
+    st.caption(f"Run started {run[0]['run']}{status}")
+    current = next((record for record in reversed(run) if 'epoch' in record), last)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Phase", "Fine-tuning" if current.get('phase') == 1 else "Head training")
+    col2.metric("Epoch", current['epoch'] + 1 if 'epoch' in current else "-")
+    col3.metric("Learning rate", f"{last['lr']:.2e}")
+    rate = next((record['images_per_sec'] for record in reversed(batches) if record.get('images_per_sec')), None)
+    col4.metric("Images / s", f"{rate:.1f}" if rate else "-")
+    
+    if batches:
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=[r['step'] for r in batches], y=[r.get('loss') for r in batches], name="Loss"))
+        fig.add_trace(go.Scatter(x=[r['step'] for r in batches], y=[r.get('accuracy') for r in batches],
+                                 name="Accuracy", yaxis='y2'))
+        fig.update_layout(title="Training batches", xaxis_title="Step", yaxis_title="Loss",
+                          yaxis2=dict(title="Accuracy", overlaying='y', side='right'))
+        st.plotly_chart(fig, use_container_width=True)
+    
+    if epochs:
+        labels = [f"{'F' if r['phase'] == 1 else 'H'}{r['epoch'] + 1}" for r in epochs]
+        fig = go.Figure()
+        for key, name in [('accuracy', "Training accuracy"), ('val_accuracy', "Validation accuracy")]:
+            fig.add_trace(go.Scatter(x=labels, y=[r.get(key) for r in epochs], name=name))
+        fig.update_layout(title="Accuracy per epoch (H = head training, F = fine-tuning)", yaxis_title="Accuracy")
+        st.plotly_chart(fig, use_container_width=True)
+        
+        fig = go.Figure(go.Scatter(x=labels, y=[r['lr'] for r in epochs], mode='lines+markers'))
+        fig.update_layout(title="Learning rate", yaxis_type='log')
+        st.plotly_chart(fig, use_container_width=True)
+
 def get_confidence_color(confidence):
     """Get color based on confidence level"""
     if confidence >= 0.8:
@@ -125,7 +289,7 @@ def main():
     st.sidebar.title("Navigation")
     page = st.sidebar.selectbox(
         "Choose a page",
-        ["Home", "Upload & Predict", "Model Information", "About"]
+        ["Home", "Upload & Predict", "Model Information", "Training Monitor", "About"]
     )
     
     if page == "Home":
@@ -202,15 +366,39 @@ def main():
             with col2:
                 st.subheader("🔍 Analysis")
                 
+                # Reject unusable uploads before they use model capacity
+                quality = check_image_quality(image)
+                for issue in quality['flagged']:
+                    st.warning(f"{issue}. Results may be less reliable.")
+                if not quality['usable']:
+                    st.error("This image can't be analyzed reliably: " + "; ".join(quality['rejected']) + ".")
+                    st.stop()
+                
                 # Preprocess image
                 img_array = preprocess_image(image)
                 
                 # Make prediction
-                with st.spinner("Analyzing image..."):
-                    prediction = detector.model.predict(img_array)
-                    predicted_class = np.argmax(prediction[0])
-                    confidence = prediction[0][predicted_class]
-                    disease_name = detector.class_names[predicted_class]
+                status = st.empty()
+                
+                def show_queue_position(position):
+                    status.info(f"Waiting for a free slot - position {position} in the queue...")
+                
+                def analyze(batch):
+                    status.info("Analyzing image...")
+                    return detector.predict_adaptive(batch, queue_depth=get_inference_gate().queue_depth())
+                
+                try:
+                    result = get_inference_gate().run(analyze, img_array, on_wait=show_queue_position)
+                except GateRejected as e:
+                    status.empty()
+                    st.error(str(e))
+                    st.stop()
+                status.empty()
+                
+                prediction = result['probabilities']
+                predicted_class = np.argmax(prediction[0])
+                confidence = prediction[0][predicted_class]
+                disease_name = detector.class_names[predicted_class]
                 
                 # Display results
                 st.markdown(f"""
@@ -220,6 +408,13 @@ def main():
                     <p>Confidence: <span class="{get_confidence_color(confidence)}">{confidence:.2%}</span></p>
                 </div>
                 """, unsafe_allow_html=True)
+                st.caption(f"Model variant: {result['variant']}")
+                if 'normalized_entropy' in result:
+                    st.caption(f"Model uncertainty (MC dropout): {result['normalized_entropy'][0]:.0%}")
+                for head_name, head_probs in result.get('heads', {}).items():
+                    group_names = detector.heads[head_name]['class_names']
+                    top_group = int(np.argmax(head_probs[0]))
+                    st.caption(f"{head_name.title()}: {group_names[top_group]} ({head_probs[0][top_group]:.1%})")
                 
                 # Confidence level indicator
                 if confidence >= 0.8:
@@ -340,6 +535,9 @@ def main():
             st.subheader("📊 Confusion Matrix")
             st.image('confusion_matrix.png', caption="Model Performance by Disease Category")
     
+    elif page == "Training Monitor":
+        show_training_monitor()
+    
     elif page == "About":
         st.header("ℹ️ About This Application")
         
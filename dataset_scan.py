@@ -0,0 +1,211 @@
+import os
+import io
+import json
+import hashlib
+import argparse
+from multiprocessing import Pool
+import numpy as np
+import cv2
+from PIL import Image
+
+# Same file types flow_from_directory picks up
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.ppm', '.tif', '.tiff')
+CACHE_FILE = '.scan_cache.json'
+
+
+def list_images(root='dataset'):
+    """(split, class, path) for every image under root/<split>/<class>/"""
+    entries = []
+    for split in sorted(os.listdir(root)):
+        split_dir = os.path.join(root, split)
+        if not os.path.isdir(split_dir):
+            continue
+        for label in sorted(os.listdir(split_dir)):
+            class_dir = os.path.join(split_dir, label)
+            if not os.path.isdir(class_dir):
+                continue
+            for dirpath, _, filenames in os.walk(class_dir):
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(IMAGE_EXTENSIONS):
+                        entries.append((split, label, os.path.join(dirpath, filename)))
+    return entries
+
+
+def perceptual_hash(gray):
+    """64-bit DCT hash of a 32x32 grayscale image: which low frequencies lie above their median"""
+    low = cv2.dct(gray)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def scan_file(path):
+    """Exact and perceptual hash of one image, or why it can't be decoded"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        with Image.open(io.BytesIO(data)) as image:
+            # A full decode; verify() alone misses truncated files
+            image.load()
+            gray = image.convert('L').resize((32, 32), Image.BILINEAR)
+        return {
+            'sha256': hashlib.sha256(data).hexdigest(),
+            'phash': f"{perceptual_hash(np.asarray(gray, dtype=np.float32)):016x}"
+        }
+    except Exception as e:
+        return {'error': f"{type(e).__name__}: {e}"}
+
+
+def scan_dataset(root='dataset', workers=None, chunksize=16):
+    """Hash every image in parallel, reusing cached results for files that have not changed
+
+    The cache lives in root/.scan_cache.json and is keyed by path, size and
+    modification time, so a later scan only decodes new or edited files.
+    """
+    entries = list_images(root)
+    cache_path = os.path.join(root, CACHE_FILE)
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+
+    results = {}
+    todo = []
+    for _, _, path in entries:
+        stat = os.stat(path)
+        cached = cache.get(path)
+        if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            results[path] = cached
+        else:
+            todo.append((path, stat))
+
+    if todo:
+        with Pool(workers) as pool:
+            scanned = pool.imap(scan_file, [path for path, _ in todo], chunksize=chunksize)
+            for (path, stat), result in zip(todo, scanned):
+                results[path] = dict(result, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+    # Rewrite the cache with current files only, so deleted images drop out
+    with open(cache_path, 'w') as f:
+        json.dump(results, f)
+    print(f"Scanned {len(todo)} new or changed images; {len(entries) - len(todo)} came from the cache")
+    return entries, results
+
+
+def popcount(values):
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def find_near_duplicates(hashes, max_distance=6):
+    """Index pairs whose perceptual hashes differ in at most `max_distance` bits
+
+    The 64-bit hashes are cut into more bands than `max_distance` and only
+    hashes sharing a band are compared. Every close pair shares at least one
+    band, so no pair is missed and most pairs are never compared.
+    """
+    bands = next(n for n in (2, 4, 8, 16, 32, 64) if n > max_distance)
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    band_bits = 64 // bands
+    found = {}
+    for band in range(bands):
+        keys = (hashes >> np.uint64(band * band_bits)) & np.uint64((1 << band_bits) - 1)
+        order = np.argsort(keys, kind='stable')
+        boundaries = np.flatnonzero(np.diff(keys[order])) + 1
+        for bucket in np.split(order, boundaries):
+            if len(bucket) < 2:
+                continue
+            i, j = np.triu_indices(len(bucket), k=1)
+            a, b = np.minimum(bucket[i], bucket[j]), np.maximum(bucket[i], bucket[j])
+            distance = popcount(hashes[a] ^ hashes[b])
+            close = distance <= max_distance
+            found.update(zip(zip(a[close].tolist(), b[close].tolist()), distance[close].tolist()))
+    return sorted((a, b, d) for (a, b), d in found.items())
+
+
+def build_report(entries, results, max_distance=6):
+    """Corrupt files, exact and near duplicates within a split, and train/test leakage"""
+    corrupt = []
+    valid = []
+    for split, label, path in entries:
+        result = results[path]
+        if 'error' in result:
+            corrupt.append({'path': path, 'split': split, 'class': label, 'error': result['error']})
+        else:
+            valid.append((split, label, path))
+
+    def describe(members):
+        return [{'path': path, 'split': split, 'class': label} for split, label, path in members]
+
+    report = {
+        'images': len(entries),
+        'corrupt': corrupt,
+        'exact_duplicates': [],
+        'near_duplicates': [],
+        'leakage': [],
+        'label_conflicts': []
+    }
+
+    groups = {}
+    for entry in valid:
+        groups.setdefault(results[entry[2]]['sha256'], []).append(entry)
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        item = {'match': 'exact', 'images': describe(members)}
+        if len({split for split, _, _ in members}) > 1:
+            report['leakage'].append(item)
+        else:
+            report['exact_duplicates'].append(item)
+        if len({label for _, label, _ in members}) > 1:
+            report['label_conflicts'].append(item)
+
+    hashes = [int(results[path]['phash'], 16) for _, _, path in valid]
+    for a, b, distance in find_near_duplicates(hashes, max_distance):
+        first, second = valid[a], valid[b]
+        if results[first[2]]['sha256'] == results[second[2]]['sha256']:
+            continue
+        item = {'match': 'near', 'distance': distance, 'images': describe([first, second])}
+        if first[0] != second[0]:
+            report['leakage'].append(item)
+        else:
+            report['near_duplicates'].append(item)
+        if first[1] != second[1]:
+            report['label_conflicts'].append(item)
+    return report
+
+
+def print_report(report, limit=10):
+    print(f"\n{report['images']} images scanned")
+    print(f"Corrupt or unreadable: {len(report['corrupt'])}")
+    for item in report['corrupt'][:limit]:
+        print(f"  {item['path']}: {item['error']}")
+    print(f"Exact duplicate groups within a split: {len(report['exact_duplicates'])}")
+    print(f"Near-duplicate pairs within a split: {len(report['near_duplicates'])}")
+    print(f"Duplicates shared between splits (leakage): {len(report['leakage'])}")
+    for item in report['leakage'][:limit]:
+        print(f"  {item['match']}: " + " <-> ".join(f"{i['split']}/{i['class']}/{os.path.basename(i['path'])}"
+                                                   for i in item['images']))
+    print(f"Duplicates with conflicting labels: {len(report['label_conflicts'])}")
+    if report['leakage']:
+        print("Test images that also appear in training inflate the test accuracy; "
+              "remove them from dataset/test before comparing models.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the dataset for corrupt images, duplicates and leakage")
+    parser.add_argument('--root', default='dataset', help="Directory holding the train/ and test/ splits")
+    parser.add_argument('--workers', type=int, default=None, help="Decode processes (default: all CPUs)")
+    parser.add_argument('--max-distance', type=int, default=6,
+                        help="Largest perceptual-hash bit difference counted as a near duplicate")
+    parser.add_argument('--report', default='dataset_scan_report.json')
+    args = parser.parse_args()
+
+    entries, results = scan_dataset(args.root, workers=args.workers)
+    report = build_report(entries, results, max_distance=args.max_distance)
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"\nFull report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import os
+import json
+import numpy as np
+
+EMBEDDINGS_FILE = 'embeddings.npy'
+NORMS_FILE = 'norms.npy'
+METADATA_FILE = 'metadata.json'
+IVF_FILE = 'ivf.npz'
+
+
+def normalize(vectors):
+    """L2-normalize rows so a dot product is the cosine similarity"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _merge_top_k(scores, ids, k):
+    """Keep the k best (score, id) pairs per row, sorted best first"""
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, part, axis=1)
+        ids = np.take_along_axis(ids, part, axis=1)
+    order = np.argsort(-scores, axis=1)
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+class EmbeddingIndex:
+    """Cosine nearest-neighbour index over float16 embeddings stored in a memory-mapped .npy
+
+    Rows are unit-normalized when written and their original norms are kept, so
+    features() can hand the raw backbone features back for head training. Without
+    an IVF layer every search is an exact, chunked matrix product; after
+    train_ivf() the rows are grouped by their coarse centroid and a search only
+    scans the `nprobe` closest lists.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.embeddings = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode='r')
+        with open(os.path.join(directory, METADATA_FILE)) as f:
+            metadata = json.load(f)
+        self.norms = np.load(os.path.join(directory, NORMS_FILE))
+        self.paths = metadata['paths']
+        self.labels = metadata['labels']
+        self.class_names = metadata.get('class_names', sorted(set(self.labels)))
+        # Digest of the backbone the features came from; scores against another one are meaningless
+        self.backbone = metadata.get('backbone')
+        self.centroids = None
+        self.offsets = None
+        ivf_path = os.path.join(directory, IVF_FILE)
+        if os.path.exists(ivf_path):
+            ivf = np.load(ivf_path)
+            self.centroids = ivf['centroids']
+            self.offsets = ivf['offsets']
+
+    def __len__(self):
+        return len(self.paths)
+
+    @classmethod
+    def create(cls, directory, batches, total, paths, labels, class_names=None, existing=None, backbone=None):
+        """Write an index from an iterator of raw feature batches without holding them in memory
+
+        When `existing` is given its rows are copied first and the new batches
+        are appended after them. `backbone` identifies the model that computed
+        the features (SkinDiseaseDetector.backbone_digest()).
+        """
+        os.makedirs(directory, exist_ok=True)
+        offset = len(existing) if existing is not None else 0
+        tmp_path = os.path.join(directory, EMBEDDINGS_FILE + '.tmp')
+        embeddings = None
+        norms = np.zeros(offset + total, dtype=np.float32)
+        row = offset
+        for batch in batches:
+            batch = np.asarray(batch, dtype=np.float32)
+            if embeddings is None:
+                embeddings = np.lib.format.open_memmap(
+                    tmp_path, mode='w+', dtype=np.float16, shape=(offset + total, batch.shape[1])
+                )
+                if existing is not None:
+                    embeddings[:offset] = existing.embeddings
+                    norms[:offset] = existing.norms
+            norms[row:row + len(batch)] = np.linalg.norm(batch, axis=1)
+            embeddings[row:row + len(batch)] = normalize(batch)
+            row += len(batch)
+        embeddings.flush()
+        del embeddings
+        if existing is not None:
+            existing.embeddings = None
+            paths = existing.paths + list(paths)
+            labels = existing.labels + list(labels)
+            class_names = class_names or existing.class_names
+            backbone = backbone or existing.backbone
+        os.replace(tmp_path, os.path.join(directory, EMBEDDINGS_FILE))
+        np.save(os.path.join(directory, NORMS_FILE), norms)
+        with open(os.path.join(directory, METADATA_FILE), 'w') as f:
+            json.dump({
+                'paths': list(paths),
+                'labels': list(labels),
+                'class_names': list(class_names or sorted(set(labels))),
+                'backbone': backbone
+            }, f)
+        ivf_path = os.path.join(directory, IVF_FILE)
+        if os.path.exists(ivf_path):
+            os.remove(ivf_path)
+        return cls(directory)
+
+    def features(self, ids=None):
+        """Raw (un-normalized) float32 features for the given rows, or all rows"""
+        if ids is None:
+            return np.asarray(self.embeddings, dtype=np.float32) * self.norms[:, None]
+        ids = np.asarray(ids)
+        return np.asarray(self.embeddings[ids], dtype=np.float32) * self.norms[ids, None]
+
+    def train_ivf(self, nlist=256, iterations=10, sample_size=100000, chunk_size=65536, seed=0):
+        """Cluster the rows into `nlist` lists and rewrite the file grouped by list"""
+        rng = np.random.default_rng(seed)
+        count = len(self)
+        nlist = min(nlist, count)
+        sample = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+        data = self.embeddings[sample].astype(np.float32)
+
+        # Spherical k-means on a sample
+        centroids = data[rng.choice(len(data), size=nlist, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(data @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, data)
+            empty = np.bincount(assignment, minlength=nlist) == 0
+            sums[empty] = centroids[empty]
+            centroids = normalize(sums)
+
+        # Assign every row, then store rows contiguously per list
+        assignment = np.concatenate([
+            np.argmax(self.embeddings[i:i + chunk_size].astype(np.float32) @ centroids.T, axis=1)
+            for i in range(0, count, chunk_size)
+        ])
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))])
+
+        tmp_path = os.path.join(self.directory, EMBEDDINGS_FILE + '.tmp')
+        reordered = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float16,
+                                              shape=self.embeddings.shape)
+        for i in range(0, count, chunk_size):
+            # Read in file order, then put the rows back into list order
+            chunk = order[i:i + chunk_size]
+            sorted_ids = np.sort(chunk)
+            reordered[i:i + len(chunk)] = self.embeddings[sorted_ids][np.searchsorted(sorted_ids, chunk)]
+        reordered.flush()
+        del reordered
+        self.embeddings = None
+        os.replace(tmp_path, os.path.join(self.directory, EMBEDDINGS_FILE))
+
+        np.save(os.path.join(self.directory, NORMS_FILE), self.norms[order])
+        with open(os.path.join(self.directory, METADATA_FILE), 'w') as f:
+            json.dump({
+                'paths': [self.paths[i] for i in order],
+                'labels': [self.labels[i] for i in order],
+                'class_names': self.class_names,
+                'backbone': self.backbone
+            }, f)
+        np.savez(os.path.join(self.directory, IVF_FILE), centroids=centroids, offsets=offsets)
+        self.__init__(self.directory)
+        print(f"IVF index with {nlist} lists over {count} embeddings")
+
+    def _search_exact(self, queries, k, chunk_size):
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(self), chunk_size):
+            chunk = np.asarray(self.embeddings[start:start + chunk_size], dtype=np.float32)
+            scores = queries @ chunk.T
+            ids = np.broadcast_to(np.arange(start, start + len(chunk)), scores.shape)
+            best_scores, best_ids = _merge_top_k(
+                np.concatenate([best_scores, scores], axis=1),
+                np.concatenate([best_ids, ids], axis=1), k
+            )
+        return best_scores, best_ids
+
+    def _search_ivf(self, queries, k, nprobe):
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        all_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for q, lists in enumerate(probes):
+            ids = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+            if len(ids) == 0:
+                continue
+            # Probed lists are contiguous slices, so this reads a few ranges of the file
+            candidates = np.concatenate([
+                np.asarray(self.embeddings[self.offsets[l]:self.offsets[l + 1]], dtype=np.float32)
+                for l in lists
+            ])
+            scores, found = _merge_top_k((candidates @ queries[q])[None, :], ids[None, :], k)
+            all_scores[q, :scores.shape[1]] = scores[0]
+            all_ids[q, :found.shape[1]] = found[0]
+        return all_scores, all_ids
+
+    def search(self, queries, k=5, nprobe=8, chunk_size=65536):
+        """Top-k cosine matches for a batch of query embeddings
+
+        Returns (scores, ids); unused slots when fewer than k rows were scanned
+        have id -1.
+        """
+        queries = normalize(np.atleast_2d(queries))
+        k = min(k, len(self))
+        if self.centroids is not None:
+            return self._search_ivf(queries, k, nprobe)
+        return self._search_exact(queries, k, chunk_size)
+
+    def lookup(self, ids):
+        """Label and path for each id returned by search()"""
+        return [(self.labels[i], self.paths[i]) for i in ids if i >= 0]
@@ -5,14 +5,20 @@ from PIL import Image
 import os
 import plotly.graph_objects as go
 import plotly.express as px
-from skin_disease_model import SkinDiseaseDetector
+from skin_disease_model import SkinDiseaseDetector, render_cam_overlay, check_image_quality
+from inference_gate import InferenceGate, GateRejected
+from model_registry import ModelRegistry
+from embedding_index import EmbeddingIndex, METADATA_FILE
 import warnings
 warnings.filterwarnings('ignore')
 import requests
 import shutil
+from model_package import sync_package, download_file
 import time
 from streamlit.components.v1 import html
 import base64
+import hashlib
+import io
 
 # Set page config FIRST - must be the first Streamlit command
 st.set_page_config(
@@ -25,8 +31,64 @@ st.set_page_config(
 MODEL_URL = "https://www.dropbox.com/scl/fi/5wwmx63gw24afr15hxhid/skin_disease_model.h5?rlkey=we18mf6adx26eeh6hkmqss4a6&st=c1o0j81k&dl=1"
 MODEL_PATH = "skin_disease_model.h5"
 TEMP_MODEL_PATH = "skin_disease_model.h5?dl=1"
+# Versioned model package (see model_package.py); when set, only changed chunks are downloaded
+MODEL_PACKAGE_URL = ""
+MODEL_PACKAGE_DIR = "model_package"
+# Compressed float16 artifact (see `python model_package.py compress`); used instead of the H5 file when set
+MODEL_ARTIFACT_URL = ""
+MODEL_ARTIFACT_PATH = "skin_disease_model.f16.zst"
+# How often the background watcher looks for a new model version on disk
+MODEL_POLL_SECONDS = 30
+# Create this file (e.g. `touch rollback_model`) to switch back to the previously served version
+ROLLBACK_MARKER_PATH = "rollback_model"
+
+# Inference admission control (shared by all sessions of this process)
+INFERENCE_MAX_IN_FLIGHT = 1
+INFERENCE_MAX_QUEUE = 8
+INFERENCE_DEADLINE_SECONDS = 20
+# Latency target used to fall back to cheaper model variants under load
+LATENCY_SLO_SECONDS = 3.0
+# Optional distilled model answering first; the full model runs only below the threshold
+FAST_MODEL_PATH = "skin_disease_student.h5"
+CASCADE_THRESHOLD = 0.8
+# Compute precision for serving; "bfloat16" uses AVX-512 BF16 / AMX on recent Xeons
+INFERENCE_PRECISION = "float32"
+# Head-only update published by `python skin_disease_model.py add-classes`
+HEAD_UPDATE_PATH = "skin_disease_head.h5"
+# Monte-Carlo dropout samples per request (0 disables) and the triage threshold
+MC_DROPOUT_SAMPLES = 20
+UNCERTAINTY_THRESHOLD = 0.5
+# Time allowed for test-time augmentation views in careful mode
+TTA_LATENCY_BUDGET_SECONDS = 1.5
+# Uploads at least this large (longest side, pixels) can use tiled high-resolution analysis
+TILED_MIN_SIDE = 1000
+# Coarse head computed from the same backbone pass as the diagnosis
+MALIGNANCY_GROUPS = {
+    "Malignant or pre-malignant": [
+        "Actinic Keratosis and Malignant Lesions",
+        "Melanoma and Skin Cancer",
+    ],
+}
+# Directory written by `python skin_disease_model.py index`
+EMBEDDING_INDEX_DIR = "embeddings"
 
 def download_model():
+    if MODEL_PACKAGE_URL:
+        try:
+            downloaded, total = sync_package(MODEL_PACKAGE_URL, MODEL_PACKAGE_DIR)
+            st.info(f"Model package synced: {downloaded / (1024*1024):.1f} of {total / (1024*1024):.1f} MB downloaded.")
+        except Exception as e:
+            st.error(f"Failed to sync model package: {e}")
+        return
+    if MODEL_ARTIFACT_URL:
+        if not os.path.exists(MODEL_ARTIFACT_PATH):
+            try:
+                elapsed = download_file(MODEL_ARTIFACT_URL, MODEL_ARTIFACT_PATH)
+                size = os.path.getsize(MODEL_ARTIFACT_PATH) / (1024*1024)
+                st.info(f"Compressed model downloaded: {size:.1f} MB in {elapsed:.1f}s.")
+            except Exception as e:
+                st.error(f"Failed to download compressed model: {e}")
+        return
     if not os.path.exists(MODEL_PATH):
         try:
             st.info("Downloading model from Dropbox...")
@@ -44,6 +106,11 @@ def download_model():
 
 download_model()
 
+if MODEL_PACKAGE_URL and os.path.exists(os.path.join(MODEL_PACKAGE_DIR, "manifest.json")):
+    MODEL_PATH = MODEL_PACKAGE_DIR
+elif MODEL_ARTIFACT_URL and os.path.exists(MODEL_ARTIFACT_PATH):
+    MODEL_PATH = MODEL_ARTIFACT_PATH
+
 if not os.path.exists(MODEL_PATH):
     st.error("Model file was not downloaded. Please check the Dropbox link or network connection.")
 else:
@@ -1137,18 +1204,67 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+def build_detector(model_path):
+    """Load a model version and prepare it for serving"""
+    detector = SkinDiseaseDetector()
+    detector.get_class_names('class_names.txt')
+    detector.load_model(model_path, precision=INFERENCE_PRECISION)
+    if os.path.exists(HEAD_UPDATE_PATH):
+        detector.apply_head_update(HEAD_UPDATE_PATH)
+    detector.split_model()
+    detector.add_grouped_head('malignancy', MALIGNANCY_GROUPS, other="Benign")
+    detector.enable_uncertainty(MC_DROPOUT_SAMPLES)
+    if os.path.exists(FAST_MODEL_PATH):
+        detector.enable_cascade(FAST_MODEL_PATH, threshold=CASCADE_THRESHOLD)
+    detector.enable_load_adaptive(
+        latency_slo=LATENCY_SLO_SECONDS,
+        max_in_flight=INFERENCE_MAX_IN_FLIGHT
+    )
+    return detector
+
 @st.cache_resource
+def get_model_registry():
+    """Registry that hot-swaps new model versions in the background"""
+    refresh = None
+    if MODEL_PACKAGE_URL:
+        refresh = lambda: sync_package(MODEL_PACKAGE_URL, MODEL_PACKAGE_DIR)
+    return ModelRegistry(
+        build_detector,
+        MODEL_PATH,
+        poll_interval=MODEL_POLL_SECONDS,
+        refresh=refresh,
+        watch=[HEAD_UPDATE_PATH],
+        rollback_marker=ROLLBACK_MARKER_PATH
+    ).start()
+
 def load_model():
     """Load the trained model"""
     try:
-        detector = SkinDiseaseDetector()
-        detector.get_class_names('class_names.txt')
-        detector.load_model(MODEL_PATH)
-        return detector
+        return get_model_registry().current()
     except Exception as e:
         st.error(f"Model not found or failed to load. Error: {e}")
         return None
 
+@st.cache_resource
+def get_inference_gate():
+    """Inference gate shared by every session"""
+    return InferenceGate(
+        max_in_flight=INFERENCE_MAX_IN_FLIGHT,
+        max_queue=INFERENCE_MAX_QUEUE,
+        deadline=INFERENCE_DEADLINE_SECONDS
+    )
+
+@st.cache_resource
+def _open_embedding_index(version):
+    return EmbeddingIndex(EMBEDDING_INDEX_DIR)
+
+def load_embedding_index():
+    """Similar-case index, if one has been built; reopened when it is rebuilt"""
+    metadata = os.path.join(EMBEDDING_INDEX_DIR, METADATA_FILE)
+    if not os.path.exists(metadata):
+        return None
+    return _open_embedding_index(os.stat(metadata).st_mtime_ns)
+
 def preprocess_image(image):
     """Preprocess uploaded image"""
     try:
@@ -1283,17 +1399,67 @@ def main():
                     <h3>🔍 AI Analysis</h3>
         """, unsafe_allow_html=True)
         
-        # Preprocess and predict
-        with st.spinner("🔎 Analyzing your image..."):
-            img_array = preprocess_image(image_for_pred)
-            if img_array is None:
-                st.error("Failed to preprocess image. Please try again.")
+        # Cheap quality gate before the image takes a slot on the model
+        quality = check_image_quality(image_for_pred)
+        for issue in quality['flagged']:
+            st.warning(f"⚠️ {issue}. Results may be less reliable.")
+        if not quality['usable']:
+            st.error("❌ This image can't be analyzed reliably: " + "; ".join(quality['rejected']) +
+                     ". Try uploading a clearer, better-lit image.")
+            if not st.checkbox("Analyze anyway"):
                 st.stop()
+        
+        # Preprocess and predict
+        img_array = preprocess_image(image_for_pred)
+        if img_array is None:
+            st.error("Failed to preprocess image. Please try again.")
+            st.stop()
+        
+        careful_mode = st.checkbox(
+            "🔬 Careful mode: average several views of the image",
+            help="Useful for off-center photos; takes a little longer"
+        )
+        
+        high_resolution_mode = max(image.size) >= TILED_MIN_SIDE and st.checkbox(
+            "🔍 High-resolution mode: analyze small details in overlapping tiles",
+            help="Recommended for large phone photos of small lesions"
+        )
+        
+        # Widget interactions rerun the script; reuse the result for the same upload
+        upload_key = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+        upload_key += ('-tta' if careful_mode else '') + ('-tiled' if high_resolution_mode else '')
+        analysis = st.session_state.get('analysis')
+        if analysis is None or analysis['key'] != upload_key:
+            status = st.empty()
+            
+            def show_queue_position(position):
+                status.info(f"⏳ High demand right now - you are number {position} in the queue...")
             
-            prediction = detector.model.predict(img_array)
-            predicted_class = np.argmax(prediction[0])
-            confidence = prediction[0][predicted_class]
-            disease_name = detector.class_names[predicted_class]
+            def analyze(batch):
+                status.info("🔎 Analyzing your image...")
+                if high_resolution_mode:
+                    tiled = detector.predict_tiled(io.BytesIO(uploaded_file.getvalue()))
+                    return {'probabilities': tiled['probabilities'], 'variant': f"full+tiles({tiled['tiles']})"}
+                if careful_mode:
+                    tta = detector.predict_tta(image_for_pred, latency_budget=TTA_LATENCY_BUDGET_SECONDS)
+                    return {'probabilities': tta['probabilities'], 'variant': f"full+tta({tta['views']} views)"}
+                return detector.predict_adaptive(batch, queue_depth=get_inference_gate().queue_depth())
+            
+            try:
+                result = get_inference_gate().run(analyze, img_array, on_wait=show_queue_position)
+            except GateRejected as e:
+                status.empty()
+                st.error(f"❌ {e}")
+                st.stop()
+            status.empty()
+            analysis = {'key': upload_key, 'result': result, 'overlays': {}}
+            st.session_state['analysis'] = analysis
+        result = analysis['result']
+        
+        prediction = result['probabilities']
+        predicted_class = np.argmax(prediction[0])
+        confidence = prediction[0][predicted_class]
+        disease_name = detector.class_names[predicted_class]
         
         # Display prediction results
         st.markdown(f"""
@@ -1303,6 +1469,27 @@ def main():
                         {get_confidence_badge(confidence)}
                     </div>
         """, unsafe_allow_html=True)
+        if 'malignancy' in result.get('heads', {}):
+            group_names = detector.heads['malignancy']['class_names']
+            group_probs = result['heads']['malignancy'][0]
+            top_group = int(np.argmax(group_probs))
+            st.caption(f"Malignancy screen: {group_names[top_group]} ({group_probs[top_group]:.1%})")
+        if 'normalized_entropy' in result:
+            uncertainty = result['normalized_entropy'][0]
+            if uncertainty >= UNCERTAINTY_THRESHOLD:
+                st.warning(f"⚠️ The model is uncertain between several conditions (uncertainty {uncertainty:.0%}). "
+                           "Professional evaluation is strongly recommended.")
+            else:
+                st.caption(f"Model uncertainty: {uncertainty:.0%}")
+        if result['variant'].startswith('full+tta'):
+            st.caption(f"Careful mode: {result['variant'][len('full+tta('):-1]} averaged.")
+        elif result['variant'].startswith('full+tiles'):
+            st.caption(f"High-resolution mode: {result['variant'][len('full+tiles('):-1]} skin tiles analyzed.")
+        elif result['variant'] == 'cascade' and not result['escalated'][0]:
+            st.caption("Answered by the fast model, which was confident; heatmaps, the malignancy screen "
+                       "and similar cases come only from the full model.")
+        elif detector.policy is not None and result['variant'] != detector.policy.variants[0].name:
+            st.caption(f"Served by the lighter '{result['variant']}' model because of high demand.")
         
         # Top 5 predictions chart
         st.markdown("""
@@ -1333,6 +1520,35 @@ def main():
         )
         st.plotly_chart(fig, use_container_width=True)
         
+        # Class-activation heatmaps come with the prediction; overlays are drawn on demand
+        if 'cams' in result and st.checkbox("🔥 Show the regions that drove the prediction"):
+            cam_classes = result['cam_classes'][0]
+            choice = st.selectbox(
+                "Heatmap for",
+                range(len(cam_classes)),
+                format_func=lambda i: detector.class_names[cam_classes[i]]
+            )
+            if choice not in analysis['overlays']:
+                analysis['overlays'][choice] = render_cam_overlay(image_for_pred, result['cams'][0][choice])
+            st.image(analysis['overlays'][choice], caption="Grad-CAM heatmap", width=480)
+        
+        # Similar labeled cases from the training set
+        index = load_embedding_index()
+        if index is not None and 'embedding' in result and index.backbone != detector.backbone_digest():
+            # Built with another model (an older release or the ImageNet backbone); its
+            # cosine scores against this model's embeddings would be meaningless
+            st.caption("Similar cases are unavailable until the index is rebuilt for the current model.")
+        elif index is not None and 'embedding' in result:
+            scores, ids = index.search(result['embedding'], k=5)
+            st.markdown("""
+                    <h3 style="margin-top: 1rem; margin-bottom: 1rem;">🗂️ Most Similar Labeled Cases</h3>
+            """, unsafe_allow_html=True)
+            for score, (label, path) in zip(scores[0], index.lookup(ids[0])):
+                if os.path.exists(path):
+                    st.image(path, caption=f"{label} - similarity {score:.2f}", width=160)
+                else:
+                    st.write(f"{label} - similarity {score:.2f}")
+        
         # Recommendations
         if confidence >= 0.8:
             st.markdown("""
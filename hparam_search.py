@@ -0,0 +1,146 @@
+import os
+import json
+import argparse
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+from embedding_index import EmbeddingIndex
+from skin_disease_model import SkinDiseaseDetector, DEFAULT_HPARAMS
+
+DENSE_CHOICES = [[256, 128], [512, 256], [1024, 512], [512]]
+BATCH_CHOICES = [16, 32, 64, 128]
+
+# Set in every worker process by _init_worker
+_data = None
+
+
+def sample_config(rng):
+    """Draw one set of head hyperparameters
+
+    The freeze cut-off and the fine-tuning learning rate only matter once the
+    backbone trains, so they can't be judged on cached features and keep
+    their defaults.
+    """
+    dense_units = DENSE_CHOICES[rng.integers(len(DENSE_CHOICES))]
+    return {
+        'learning_rate': float(10 ** rng.uniform(-4, -2.5)),
+        'dropout': [round(float(rng.uniform(0.1, 0.6)), 2) for _ in range(len(dense_units) + 1)],
+        'dense_units': list(dense_units),
+        'batch_size': int(rng.choice(BATCH_CHOICES))
+    }
+
+
+def _init_worker(index_dir, class_names_path, val_fraction, seed, threads):
+    """Load the cached features once per worker and split them the same way in every worker"""
+    global _data
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    detector = SkinDiseaseDetector()
+    detector.get_class_names(class_names_path)
+    index = EmbeddingIndex(index_dir)
+    class_lookup = {name: i for i, name in enumerate(detector.class_names)}
+    ids = [i for i, label in enumerate(index.labels) if label in class_lookup]
+    order = np.random.default_rng(seed).permutation(ids)
+    features = index.features(order)
+    labels = np.array([class_lookup[index.labels[i]] for i in order])
+    split = int(len(order) * (1 - val_fraction))
+    _data = {
+        'detector': detector,
+        'train': (features[:split], labels[:split]),
+        'val': (features[split:], labels[split:])
+    }
+
+
+def _run_trial(task):
+    """Train one trial's head up to `end_epoch`, continuing from its saved state; returns its val accuracy"""
+    trial_id, config, start_epoch, end_epoch, work_dir = task
+    path = os.path.join(work_dir, f'trial-{trial_id}.h5')
+    train_x, train_y = _data['train']
+    if start_epoch > 0:
+        head = tf.keras.models.load_model(path)
+    else:
+        detector = _data['detector']
+        detector.hparams = {**DEFAULT_HPARAMS, **config}
+        head = detector.create_head(train_x.shape[1])
+        head.compile(
+            optimizer=tf.keras.optimizers.legacy.Adam(learning_rate=config['learning_rate']),
+            loss='sparse_categorical_crossentropy',
+            metrics=['accuracy']
+        )
+    head.fit(train_x, train_y, batch_size=config['batch_size'], epochs=end_epoch,
+             initial_epoch=start_epoch, verbose=0)
+    head.save(path, save_format='h5')
+    _, accuracy = head.evaluate(*_data['val'], batch_size=256, verbose=0)
+    return trial_id, float(accuracy)
+
+
+def successive_halving(index_dir='imagenet_features', num_trials=27, min_epochs=2, max_epochs=54, eta=3,
+                       workers=4, work_dir='hparam_trials', class_names_path='class_names.txt',
+                       val_fraction=0.2, seed=0):
+    """Search head hyperparameters on cached backbone features with successive halving
+
+    All trials train for `min_epochs`; after each rung only the best 1/eta of
+    them continue, for eta times as many epochs, until one is left or
+    `max_epochs` is reached. Trials of a rung run in parallel worker
+    processes and resume from their saved head rather than starting over.
+    Returns (best config, its validation accuracy, per-rung results).
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    configs = {trial_id: sample_config(rng) for trial_id in range(num_trials)}
+    alive = list(configs)
+    done, budget = 0, min_epochs
+    rungs = []
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    # Spawned workers get a fresh TensorFlow runtime each
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer=_init_worker,
+                      initargs=(index_dir, class_names_path, val_fraction, seed, threads)) as pool:
+        while True:
+            tasks = [(trial_id, configs[trial_id], done, budget, work_dir) for trial_id in alive]
+            scores = dict(pool.imap_unordered(_run_trial, tasks))
+            ranked = sorted(alive, key=scores.get, reverse=True)
+            rungs.append({'epochs': budget, 'scores': {str(t): scores[t] for t in ranked}})
+            print(f"Rung at {budget} epochs: {len(ranked)} trials, best val accuracy "
+                  f"{scores[ranked[0]]:.4f} (trial {ranked[0]})")
+            if len(ranked) == 1 or budget >= max_epochs:
+                break
+            alive = ranked[:max(1, len(ranked) // eta)]
+            done, budget = budget, min(budget * eta, max_epochs)
+
+    best = ranked[0]
+    print(f"Best trial {best}: {configs[best]}")
+    return configs[best], scores[best], rungs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Head hyperparameter search with successive halving")
+    parser.add_argument('--index', default='imagenet_features',
+                        help="Index of ImageNet backbone features to train on; build it with "
+                             "`index --model imagenet --output imagenet_features`. Keep it apart from "
+                             "the served `embeddings` index, which holds the fine-tuned model's features")
+    parser.add_argument('--trials', type=int, default=27)
+    parser.add_argument('--min-epochs', type=int, default=2)
+    parser.add_argument('--max-epochs', type=int, default=54)
+    parser.add_argument('--eta', type=int, default=3, help="Keep the best 1/eta trials at each rung")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // 4))
+    parser.add_argument('--work-dir', default='hparam_trials')
+    parser.add_argument('--output', default='best_hparams.json')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    config, accuracy, rungs = successive_halving(
+        index_dir=args.index, num_trials=args.trials, min_epochs=args.min_epochs,
+        max_epochs=args.max_epochs, eta=args.eta, workers=args.workers,
+        work_dir=args.work_dir, seed=args.seed
+    )
+    with open(args.output, 'w') as f:
+        json.dump({**DEFAULT_HPARAMS, **config}, f, indent=2)
+    with open(os.path.join(args.work_dir, 'results.json'), 'w') as f:
+        json.dump({'best': config, 'val_accuracy': accuracy, 'rungs': rungs}, f, indent=2)
+    print(f"Best hyperparameters written to {args.output}; train with `--hparams {args.output}`")
+
+
+if __name__ == "__main__":
+    main()
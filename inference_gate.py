@@ -0,0 +1,126 @@
+import threading
+import time
+import itertools
+from collections import deque
+
+
+class GateRejected(Exception):
+    """Raised when the gate turns a request away instead of running it"""
+
+
+class GateTimeout(GateRejected):
+    """Raised when a queued request is not admitted before its deadline"""
+
+
+class InferenceGate:
+    """Admission control shared by every session that runs the model
+
+    At most `max_in_flight` requests run at once, at most `max_queue` wait
+    behind them in FIFO order and a waiting request gives up after `deadline`
+    seconds. Anything beyond that is rejected immediately so an overloaded
+    replica answers "busy" quickly instead of slowing every session down.
+    """
+
+    def __init__(self, max_in_flight=1, max_queue=8, deadline=20.0, poll_interval=0.25):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._in_flight = 0
+        self._tickets = itertools.count()
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def queue_depth(self):
+        """Number of requests currently waiting for a slot"""
+        with self._cond:
+            return len(self._waiting)
+
+    def stats(self):
+        """Snapshot of the gate counters"""
+        with self._cond:
+            return {
+                'in_flight': self._in_flight,
+                'queued': len(self._waiting),
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+            }
+
+    def _can_start(self, ticket):
+        return self._in_flight < self.max_in_flight and self._waiting[0] == ticket
+
+    def _acquire(self, deadline, on_wait):
+        expires = time.monotonic() + deadline
+        with self._cond:
+            # Fast path: a free slot and nobody ahead of us
+            if self._in_flight < self.max_in_flight and not self._waiting:
+                self._in_flight += 1
+                return
+            if len(self._waiting) >= self.max_queue:
+                self.rejected += 1
+                raise GateRejected(
+                    "The server is busy analyzing other images right now. "
+                    "Please try again in a moment."
+                )
+            ticket = next(self._tickets)
+            self._waiting.append(ticket)
+
+        position = None
+        try:
+            while True:
+                with self._cond:
+                    if self._can_start(ticket):
+                        self._waiting.popleft()
+                        self._in_flight += 1
+                        self._cond.notify_all()
+                        return
+                    remaining = expires - time.monotonic()
+                    if remaining <= 0:
+                        self._waiting.remove(ticket)
+                        self.timed_out += 1
+                        self._cond.notify_all()
+                        raise GateTimeout(
+                            f"Your image waited more than {deadline:g}s in the queue. "
+                            "Please try again in a moment."
+                        )
+                    new_position = self._waiting.index(ticket) + 1
+
+                # Report progress outside the lock so a slow UI never blocks the gate
+                if on_wait is not None and new_position != position:
+                    on_wait(new_position)
+                position = new_position
+
+                with self._cond:
+                    if not self._can_start(ticket):
+                        self._cond.wait(min(remaining, self.poll_interval))
+        except BaseException:
+            # on_wait can raise (Streamlit stops a script on rerun); never leave the ticket
+            # at the head of the queue, where it would block every later request
+            with self._cond:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    self._cond.notify_all()
+            raise
+
+    def _release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self.completed += 1
+            self._cond.notify_all()
+
+    def run(self, fn, *args, deadline=None, on_wait=None, **kwargs):
+        """Run fn(*args, **kwargs) once a slot is free
+
+        on_wait(position) is called whenever the request's 1-based queue
+        position changes. Raises GateRejected when the queue is full and
+        GateTimeout when the deadline passes before a slot frees up.
+        """
+        self._acquire(self.deadline if deadline is None else deadline, on_wait)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._release()
@@ -0,0 +1,336 @@
+import os
+import io
+import json
+import hashlib
+import argparse
+import time
+import numpy as np
+import requests
+import tensorflow as tf
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+MANIFEST_FILE = 'manifest.json'
+CHUNKS_DIR = 'chunks'
+VERSIONS_DIR = 'versions'
+
+ARTIFACT_SUFFIX = '.zst'
+ARTIFACT_MAGIC = b'SDMZ1\n'
+
+
+def iter_weight_layers(model, prefix=''):
+    """Yield (path, layer) for every layer holding weights, descending into nested models"""
+    for layer in model.layers:
+        path = f"{prefix}{layer.name}"
+        if isinstance(layer, tf.keras.Model):
+            yield from iter_weight_layers(layer, prefix=f"{path}/")
+        elif layer.weights:
+            yield path, layer
+
+
+def _serialize(arrays):
+    buffer = io.BytesIO()
+    for array in arrays:
+        np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def _deserialize(data, count):
+    buffer = io.BytesIO(data)
+    return [np.load(buffer, allow_pickle=False) for _ in range(count)]
+
+
+def _chunk_path(directory, digest):
+    return os.path.join(directory, CHUNKS_DIR, digest)
+
+
+def _write_json(path, payload):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+def export_package(model, directory, version):
+    """Write the model as a manifest plus one content-addressed chunk per weighted layer
+
+    Chunks that already exist (same bytes in an earlier version) are reused, so a
+    release that only changed the dense head adds just a handful of small files.
+    """
+    os.makedirs(os.path.join(directory, CHUNKS_DIR), exist_ok=True)
+    os.makedirs(os.path.join(directory, VERSIONS_DIR), exist_ok=True)
+    chunks = []
+    new_bytes = 0
+    for path, layer in iter_weight_layers(model):
+        weights = layer.get_weights()
+        data = _serialize(weights)
+        digest = hashlib.sha256(data).hexdigest()
+        chunk_path = _chunk_path(directory, digest)
+        if not os.path.exists(chunk_path):
+            with open(chunk_path, 'wb') as f:
+                f.write(data)
+            new_bytes += len(data)
+        chunks.append({'layer': path, 'sha256': digest, 'size': len(data), 'count': len(weights)})
+
+    manifest = {
+        'version': str(version),
+        'architecture': model.to_json(),
+        'chunks': chunks,
+    }
+    _write_json(os.path.join(directory, VERSIONS_DIR, f"{version}.json"), manifest)
+    _write_json(os.path.join(directory, MANIFEST_FILE), manifest)
+    total = sum(chunk['size'] for chunk in chunks)
+    print(f"Exported version {version}: {len(chunks)} chunks, "
+          f"{new_bytes / (1024*1024):.1f} of {total / (1024*1024):.1f} MB new")
+    return manifest
+
+
+def read_manifest(directory):
+    """Manifest of the version currently installed in directory, or None"""
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def sync_package(base_url, directory, timeout=60):
+    """Fetch the latest manifest and only the chunks missing locally
+
+    The local manifest is replaced only after every chunk has been downloaded
+    and verified, so an interrupted sync leaves the installed version intact.
+    Returns (downloaded_bytes, total_bytes).
+    """
+    base_url = base_url.rstrip('/')
+    os.makedirs(os.path.join(directory, CHUNKS_DIR), exist_ok=True)
+    os.makedirs(os.path.join(directory, VERSIONS_DIR), exist_ok=True)
+    response = requests.get(f"{base_url}/{MANIFEST_FILE}", timeout=timeout)
+    response.raise_for_status()
+    manifest = response.json()
+
+    downloaded = 0
+    for chunk in manifest['chunks']:
+        chunk_path = _chunk_path(directory, chunk['sha256'])
+        if os.path.exists(chunk_path):
+            continue
+        digest = hashlib.sha256()
+        tmp_path = chunk_path + '.part'
+        with requests.get(f"{base_url}/{CHUNKS_DIR}/{chunk['sha256']}", stream=True, timeout=timeout) as r:
+            r.raise_for_status()
+            with open(tmp_path, 'wb') as f:
+                for block in r.iter_content(chunk_size=1 << 16):
+                    digest.update(block)
+                    f.write(block)
+        if digest.hexdigest() != chunk['sha256']:
+            os.remove(tmp_path)
+            raise ValueError(f"Checksum mismatch for chunk of layer {chunk['layer']}")
+        os.replace(tmp_path, chunk_path)
+        downloaded += chunk['size']
+
+    _write_json(os.path.join(directory, VERSIONS_DIR, f"{manifest['version']}.json"), manifest)
+    _write_json(os.path.join(directory, MANIFEST_FILE), manifest)
+    total = sum(chunk['size'] for chunk in manifest['chunks'])
+    print(f"Synced version {manifest['version']}: downloaded "
+          f"{downloaded / (1024*1024):.1f} of {total / (1024*1024):.1f} MB")
+    return downloaded, total
+
+
+def apply_package(model, directory, manifest=None, previous=None):
+    """Load chunk weights into model, skipping layers whose hash matches `previous`"""
+    manifest = manifest or read_manifest(directory)
+    unchanged = {}
+    if previous is not None:
+        unchanged = {chunk['layer']: chunk['sha256'] for chunk in previous['chunks']}
+    layers_by_path = dict(iter_weight_layers(model))
+    applied = 0
+    for chunk in manifest['chunks']:
+        if unchanged.get(chunk['layer']) == chunk['sha256']:
+            continue
+        with open(_chunk_path(directory, chunk['sha256']), 'rb') as f:
+            layers_by_path[chunk['layer']].set_weights(_deserialize(f.read(), chunk['count']))
+        applied += 1
+    return applied
+
+
+def load_package(directory):
+    """Rebuild the model from the installed manifest and its chunks"""
+    manifest = read_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(f"No model package installed in {directory}")
+    model = tf.keras.models.model_from_json(manifest['architecture'])
+    apply_package(model, directory, manifest)
+    print(f"Loaded model package version {manifest['version']}")
+    return model
+
+
+def prune_chunks(directory):
+    """Delete chunks no longer referenced by any recorded version"""
+    referenced = set()
+    versions_dir = os.path.join(directory, VERSIONS_DIR)
+    for name in os.listdir(versions_dir):
+        with open(os.path.join(versions_dir, name)) as f:
+            referenced.update(chunk['sha256'] for chunk in json.load(f)['chunks'])
+    removed = 0
+    for name in os.listdir(os.path.join(directory, CHUNKS_DIR)):
+        if name not in referenced:
+            os.remove(_chunk_path(directory, name))
+            removed += 1
+    print(f"Removed {removed} unreferenced chunks")
+
+
+def _require_zstd():
+    if zstd is None:
+        raise ImportError("Compressed model artifacts need the 'zstandard' package: pip install zstandard")
+
+
+def export_artifact(model, path, dtype='float16', level=19):
+    """Write the model as one zstd stream: header, then every weight tensor in order
+
+    Float tensors are stored as `dtype` (float16 halves the size before
+    compression); they are cast back to the variable dtype when loaded.
+    """
+    _require_zstd()
+    tensors = []
+    for layer_path, layer in iter_weight_layers(model):
+        for i, weight in enumerate(layer.weights):
+            stored = dtype if weight.dtype.is_floating else weight.dtype.name
+            tensors.append({'layer': layer_path, 'index': i, 'shape': list(weight.shape), 'dtype': stored})
+    header = json.dumps({'architecture': model.to_json(), 'tensors': tensors}).encode()
+
+    compressor = zstd.ZstdCompressor(level=level, threads=-1)
+    with open(path, 'wb') as f, compressor.stream_writer(f) as writer:
+        writer.write(ARTIFACT_MAGIC)
+        writer.write(len(header).to_bytes(8, 'little'))
+        writer.write(header)
+        for layer_path, layer in iter_weight_layers(model):
+            for weight in layer.weights:
+                stored = dtype if weight.dtype.is_floating else weight.dtype.name
+                writer.write(np.ascontiguousarray(weight.numpy().astype(stored)).tobytes())
+    print(f"Artifact written to {path} ({os.path.getsize(path) / (1024*1024):.1f} MB)")
+
+
+def _read_exact(reader, size):
+    data = bytearray()
+    while len(data) < size:
+        block = reader.read(size - len(data))
+        if not block:
+            raise EOFError("Model artifact is truncated")
+        data.extend(block)
+    return bytes(data)
+
+
+def load_artifact(path):
+    """Rebuild the model and stream-decompress each tensor straight into its variable
+
+    Only one tensor is held in memory at a time besides the model itself.
+    """
+    _require_zstd()
+    with open(path, 'rb') as f, zstd.ZstdDecompressor().stream_reader(f) as reader:
+        if _read_exact(reader, len(ARTIFACT_MAGIC)) != ARTIFACT_MAGIC:
+            raise ValueError(f"{path} is not a compressed model artifact")
+        header_size = int.from_bytes(_read_exact(reader, 8), 'little')
+        header = json.loads(_read_exact(reader, header_size))
+        model = tf.keras.models.model_from_json(header['architecture'])
+        layers_by_path = dict(iter_weight_layers(model))
+        for tensor in header['tensors']:
+            dtype = np.dtype(tensor['dtype'])
+            count = int(np.prod(tensor['shape']))
+            data = _read_exact(reader, count * dtype.itemsize)
+            variable = layers_by_path[tensor['layer']].weights[tensor['index']]
+            variable.assign(np.frombuffer(data, dtype=dtype).reshape(tensor['shape']).astype(variable.dtype.name))
+    return model
+
+
+def download_file(url, path, chunk_size=1 << 16):
+    """Download url to path, returning the elapsed seconds"""
+    start = time.perf_counter()
+    tmp_path = path + '.part'
+    with requests.get(url, stream=True) as r:
+        r.raise_for_status()
+        with open(tmp_path, 'wb') as f:
+            for block in r.iter_content(chunk_size=chunk_size):
+                f.write(block)
+    os.replace(tmp_path, path)
+    return time.perf_counter() - start
+
+
+def benchmark_artifact(h5_path, artifact_path, bandwidth_mbps=100.0, h5_url=None, artifact_url=None):
+    """Compare size, download time and load time of the H5 file and the compressed artifact
+
+    Download times are measured when URLs are given, otherwise estimated from
+    `bandwidth_mbps`.
+    """
+    results = {}
+    for name, path, url, loader in (
+        ('h5', h5_path, h5_url, tf.keras.models.load_model),
+        ('artifact', artifact_path, artifact_url, load_artifact),
+    ):
+        if url:
+            download_time = download_file(url, path + '.download')
+            os.remove(path + '.download')
+        else:
+            download_time = os.path.getsize(path) * 8 / (bandwidth_mbps * 1e6)
+        start = time.perf_counter()
+        loader(path)
+        load_time = time.perf_counter() - start
+        results[name] = {
+            'size_mb': os.path.getsize(path) / (1024*1024),
+            'download_s': download_time,
+            'load_s': load_time
+        }
+        print(f"{name:>8}: {results[name]['size_mb']:.1f} MB, download {download_time:.1f}s"
+              f"{'' if url else ' (estimated)'}, load {load_time:.1f}s")
+    print(f"Size ratio: {results['artifact']['size_mb'] / results['h5']['size_mb']:.2f}, "
+          f"time to ready: {results['h5']['download_s'] + results['h5']['load_s']:.1f}s -> "
+          f"{results['artifact']['download_s'] + results['artifact']['load_s']:.1f}s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Versioned model packages with delta downloads")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="Export an H5 model as a new package version")
+    export_parser.add_argument('model')
+    export_parser.add_argument('directory')
+    export_parser.add_argument('--version', required=True)
+
+    sync_parser = subparsers.add_parser('sync', help="Download the latest version from a package URL")
+    sync_parser.add_argument('url')
+    sync_parser.add_argument('directory')
+
+    prune_parser = subparsers.add_parser('prune', help="Remove chunks of forgotten versions")
+    prune_parser.add_argument('directory')
+
+    compress_parser = subparsers.add_parser('compress', help="Write a float16, zstd-compressed artifact")
+    compress_parser.add_argument('model')
+    compress_parser.add_argument('output')
+    compress_parser.add_argument('--dtype', default='float16', choices=['float16', 'float32'])
+    compress_parser.add_argument('--level', type=int, default=19)
+
+    benchmark_parser = subparsers.add_parser('benchmark', help="Compare the H5 file with a compressed artifact")
+    benchmark_parser.add_argument('h5')
+    benchmark_parser.add_argument('artifact')
+    benchmark_parser.add_argument('--bandwidth-mbps', type=float, default=100.0)
+    benchmark_parser.add_argument('--h5-url', default=None)
+    benchmark_parser.add_argument('--artifact-url', default=None)
+
+    args = parser.parse_args()
+    if args.command == 'export':
+        export_package(tf.keras.models.load_model(args.model), args.directory, args.version)
+    elif args.command == 'sync':
+        sync_package(args.url, args.directory)
+    elif args.command == 'prune':
+        prune_chunks(args.directory)
+    elif args.command == 'compress':
+        export_artifact(tf.keras.models.load_model(args.model), args.output, dtype=args.dtype, level=args.level)
+    elif args.command == 'benchmark':
+        benchmark_artifact(args.h5, args.artifact, bandwidth_mbps=args.bandwidth_mbps,
+                           h5_url=args.h5_url, artifact_url=args.artifact_url)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+import traceback
+import numpy as np
+from model_package import read_manifest
+
+
+def source_fingerprint(source):
+    """Identify the model version at `source` without loading it"""
+    if os.path.isdir(source):
+        manifest = read_manifest(source)
+        return manifest['version'] if manifest else None
+    if os.path.exists(source):
+        stat = os.stat(source)
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+    return None
+
+
+def warm_up_detector(detector):
+    """Run one dummy request so the first real request doesn't pay for graph tracing"""
+    dummy = np.zeros((1, *detector.img_size, 3), dtype=np.float32)
+    detector.predict_adaptive(dummy)
+
+
+class ModelRegistry:
+    """Keep a served model current by watching its source in a background thread
+
+    `loader(source)` builds a ready-to-serve detector. When the source changes
+    (new file mtime/size or new package version) and has stayed unchanged for one
+    more poll, the new version is loaded and warmed up off the request path and
+    then swapped in with a single reference assignment. Requests that already
+    hold the old detector finish on it. Files in `watch` that the loader also
+    reads (such as a head update) count as part of the version. The previous
+    version is kept so rollback() is instant; creating the `rollback_marker`
+    file triggers it on a running replica.
+    """
+
+    def __init__(self, loader, source, poll_interval=30.0, warm_up=warm_up_detector, refresh=None,
+                 watch=(), rollback_marker=None):
+        self.loader = loader
+        self.source = source
+        self.poll_interval = poll_interval
+        self.warm_up = warm_up
+        self.refresh = refresh
+        self.watch = list(watch)
+        self.rollback_marker = rollback_marker
+        self._lock = threading.Lock()
+        self._active = None
+        self._previous = None
+        self._pending = None
+        self._failed = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def fingerprint(self):
+        """Version of the source together with the state of every watched file"""
+        fingerprint = source_fingerprint(self.source)
+        if fingerprint is None or not self.watch:
+            return fingerprint
+        return '+'.join([fingerprint] + [source_fingerprint(path) or '-' for path in self.watch])
+
+    def _load(self, fingerprint):
+        detector = self.loader(self.source)
+        if self.warm_up is not None:
+            self.warm_up(detector)
+        return (fingerprint, detector)
+
+    def start(self):
+        """Load the current version synchronously, then start watching for new ones"""
+        self._active = self._load(self.fingerprint())
+        self._thread = threading.Thread(target=self._watch, name='model-registry', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def current(self):
+        """The detector that new requests should use"""
+        return self._active[1]
+
+    def version(self):
+        return self._active[0]
+
+    def previous_version(self):
+        return self._previous[0] if self._previous else None
+
+    def rollback(self):
+        """Swap back to the previously served version"""
+        with self._lock:
+            if self._previous is None:
+                return False
+            self._active, self._previous = self._previous, self._active
+            # Stay on the rolled-back version until the source changes again
+            self._failed = self._previous[0]
+            print(f"Rolled back to model version {self._active[0]}")
+            return True
+
+    def check_for_update(self):
+        """Load and swap in a new version if the source changed; returns True on swap"""
+        if self.refresh is not None:
+            self.refresh()
+        fingerprint = self.fingerprint()
+        if fingerprint is None or fingerprint in (self._active[0], self._failed):
+            self._pending = None
+            return False
+        # Only load once the source has stopped changing, e.g. after a copy finished
+        if fingerprint != self._pending:
+            self._pending = fingerprint
+            return False
+        self._pending = None
+        start = time.perf_counter()
+        try:
+            loaded = self._load(fingerprint)
+        except Exception:
+            # Don't retry the same broken version on every poll
+            self._failed = fingerprint
+            raise
+        with self._lock:
+            self._previous, self._active = self._active, loaded
+        print(f"Swapped in model version {fingerprint} "
+              f"(loaded and warmed in {time.perf_counter() - start:.1f}s)")
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                if self.rollback_marker and os.path.exists(self.rollback_marker):
+                    os.remove(self.rollback_marker)
+                    self.rollback()
+                    continue
+                self.check_for_update()
+            except Exception:
+                # Keep serving the current version if the new one is broken
+                traceback.print_exc()
@@ -0,0 +1,117 @@
+import threading
+import time
+import numpy as np
+import tensorflow as tf
+
+
+class ModelVariant:
+    """One loaded version of the classifier that can answer a request
+
+    `latency` is an exponentially weighted estimate of seconds per request,
+    seeded by warm_up() and refreshed after every call.
+    """
+
+    def __init__(self, name, img_size, smoothing=0.2):
+        self.name = name
+        self.img_size = tuple(img_size)
+        self.smoothing = smoothing
+        self.latency = None
+
+    def _resize(self, img_array):
+        if tuple(img_array.shape[1:3]) == self.img_size:
+            return img_array
+        return tf.image.resize(img_array, self.img_size).numpy()
+
+    def _run(self, img_array):
+        raise NotImplementedError
+
+    def predict(self, img_array):
+        """Return a result dict with at least the class probabilities for a batch"""
+        start = time.perf_counter()
+        output = self._run(self._resize(img_array))
+        elapsed = time.perf_counter() - start
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency += self.smoothing * (elapsed - self.latency)
+        if not isinstance(output, dict):
+            output = {'probabilities': output}
+        return output
+
+    def warm_up(self, runs=3):
+        """Run a few dummy predictions so the first request doesn't pay for tracing"""
+        dummy = np.zeros((1, *self.img_size, 3), dtype=np.float32)
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            self._run(dummy)
+            timings.append(time.perf_counter() - start)
+        self.latency = float(np.median(timings))
+
+
+class KerasVariant(ModelVariant):
+    """Variant backed by an in-memory Keras model"""
+
+    def __init__(self, name, model, img_size):
+        super().__init__(name, img_size)
+        self.model = model
+
+    def _run(self, img_array):
+        return self.model(img_array, training=False).numpy()
+
+
+class FunctionVariant(ModelVariant):
+    """Variant backed by any callable mapping a batch to probabilities or a result dict"""
+
+    def __init__(self, name, fn, img_size):
+        super().__init__(name, img_size)
+        self.fn = fn
+
+    def _run(self, img_array):
+        return self.fn(img_array)
+
+
+class TFLiteVariant(ModelVariant):
+    """Variant backed by a TensorFlow Lite flatbuffer"""
+
+    def __init__(self, name, model_path, img_size, num_threads=None):
+        super().__init__(name, img_size)
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]['index']
+        self._output = self.interpreter.get_output_details()[0]['index']
+        # The interpreter is not thread safe
+        self._lock = threading.Lock()
+
+    def _run(self, img_array):
+        img_array = np.asarray(img_array, dtype=np.float32)
+        with self._lock:
+            # A model saved with a flexible input converts to a 1x1 placeholder shape
+            if tuple(self.interpreter.get_input_details()[0]['shape']) != img_array.shape:
+                self.interpreter.resize_tensor_input(self._input, img_array.shape)
+                self.interpreter.allocate_tensors()
+            self.interpreter.set_tensor(self._input, img_array)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self._output).copy()
+
+
+class LoadAdaptivePolicy:
+    """Pick the most accurate variant that can still drain the queue within the SLO
+
+    Variants must be ordered from most to least accurate. A request admitted
+    with `queue_depth` others waiting behind it is served by the first variant
+    for which every queued request would finish within `latency_slo` seconds;
+    if none qualifies, the cheapest variant answers.
+    """
+
+    def __init__(self, variants, latency_slo=2.0, max_in_flight=1):
+        self.variants = variants
+        self.latency_slo = latency_slo
+        self.max_in_flight = max_in_flight
+
+    def select(self, queue_depth):
+        rounds = queue_depth // self.max_in_flight + 1
+        for variant in self.variants:
+            if variant.latency is None or rounds * variant.latency <= self.latency_slo:
+                return variant
+        return self.variants[-1]
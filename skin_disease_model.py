@@ -1,19 +1,387 @@
 import os
+import sys
+import json
+import math
+import time
+import socket
+import hashlib
+import argparse
+import subprocess
 import numpy as np
+import h5py
 import tensorflow as tf
 from tensorflow.keras import layers, models, optimizers
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
-from tensorflow.keras.applications import ResNet50V2
+from tensorflow.keras.applications import ResNet50V2, MobileNetV3Small, MobileNetV3Large, EfficientNetB0
 from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau, ModelCheckpoint
 import matplotlib.pyplot as plt
 import seaborn as sns
-from sklearn.metrics import classification_report, confusion_matrix
+from sklearn.metrics import classification_report, confusion_matrix, roc_auc_score
 import cv2
 from PIL import Image
 import pandas as pd
 import warnings
+from embedding_index import EmbeddingIndex, normalize
+from model_package import load_package, load_artifact, ARTIFACT_SUFFIX
+from serving_policy import KerasVariant, FunctionVariant, TFLiteVariant, LoadAdaptivePolicy
+from training_callbacks import (ResumableCheckpoint, EpochRemainder, StepProfiler, TimedSequence,
+                                TelemetryLogger, CarryState, read_progress, merge_histories)
 warnings.filterwarnings('ignore')
 
+def skin_mask(rgb):
+    """Boolean mask of skin-coloured pixels (YCrCb box rule) for an RGB uint8 array"""
+    ycrcb = cv2.cvtColor(rgb, cv2.COLOR_RGB2YCrCb)
+    return cv2.inRange(ycrcb, (0, 133, 77), (255, 173, 127)) > 0
+
+# Training hyperparameters; hparam_search.py writes tuned values that `train --hparams` loads
+DEFAULT_HPARAMS = {
+    'learning_rate': 0.001,
+    'fine_tune_learning_rate': 0.0001,
+    'dropout': [0.5, 0.3, 0.2],
+    'dense_units': [512, 256],
+    'freeze_layers': 100,
+    'batch_size': 32
+}
+
+# Training-set augmentation shared by the single-process and sharded input pipelines
+AUGMENTATION = {
+    'rotation_range': 20,
+    'width_shift_range': 0.2,
+    'height_shift_range': 0.2,
+    'shear_range': 0.2,
+    'zoom_range': 0.2,
+    'horizontal_flip': True,
+    'fill_mode': 'nearest'
+}
+
+def sample_augmentation(batch_size, height, width, augmentation=AUGMENTATION):
+    """Random AUGMENTATION parameters for a batch, drawn the way ImageDataGenerator.random_transform does
+
+    Angles are in degrees (shear too) and the two zoom factors are drawn
+    independently. Shifts are in pixels; as in Keras, tx is drawn from
+    height_shift_range but moves the image along columns, and ty the reverse.
+    """
+    def uniform(limit):
+        return tf.random.uniform([batch_size], -limit, limit)
+
+    zoom = augmentation['zoom_range']
+    return {
+        'theta': uniform(augmentation['rotation_range']),
+        'tx': uniform(augmentation['height_shift_range']) * tf.cast(height, tf.float32),
+        'ty': uniform(augmentation['width_shift_range']) * tf.cast(width, tf.float32),
+        'shear': uniform(augmentation['shear_range']),
+        'zx': tf.random.uniform([batch_size], 1 - zoom, 1 + zoom),
+        'zy': tf.random.uniform([batch_size], 1 - zoom, 1 + zoom),
+        'flip': tf.random.uniform([batch_size]) < (0.5 if augmentation['horizontal_flip'] else 0.0)
+    }
+
+def apply_augmentation(images, params):
+    """Warp a float32 batch with one ImageProjectiveTransformV3 op
+
+    Builds the same matrix as Keras' apply_affine_transform (rotation, shift,
+    shear, zoom about the image centre). Keras builds it in (x, y) = (col, row)
+    order and swaps rows and columns before handing it to scipy, so it is
+    already in the op's convention. The horizontal flip, which Keras applies
+    after the warp, is folded in. Bilinear sampling and nearest fill match
+    scipy's order=1, mode='nearest'.
+    """
+    shape = tf.shape(images)
+    height, width = tf.cast(shape[1], tf.float32), tf.cast(shape[2], tf.float32)
+    theta = params['theta'] * (np.pi / 180)
+    shear = params['shear'] * (np.pi / 180)
+    zeros = tf.zeros_like(theta)
+    ones = tf.ones_like(theta)
+
+    def matrices(rows):
+        return tf.stack([tf.stack(row, axis=-1) for row in rows], axis=-2)
+
+    rotation = matrices([[tf.cos(theta), -tf.sin(theta), zeros], [tf.sin(theta), tf.cos(theta), zeros], [zeros, zeros, ones]])
+    shift = matrices([[ones, zeros, params['tx']], [zeros, ones, params['ty']], [zeros, zeros, ones]])
+    shearing = matrices([[ones, -tf.sin(shear), zeros], [zeros, tf.cos(shear), zeros], [zeros, zeros, ones]])
+    zoom = matrices([[params['zx'], zeros, zeros], [zeros, params['zy'], zeros], [zeros, zeros, ones]])
+    # Output pixel (x, y) of a flipped image comes from column width - 1 - x
+    flip = tf.where(params['flip'][:, None, None],
+                    matrices([[-ones, zeros, ones * (width - 1)], [zeros, ones, zeros], [zeros, zeros, ones]]),
+                    tf.eye(3, batch_shape=shape[:1]))
+    # transform_matrix_offset_center centres x on the height and y on the width; kept for parity
+    center_x, center_y = height / 2 - 0.5, width / 2 - 0.5
+    offset = tf.convert_to_tensor([[1.0, 0.0, center_x], [0.0, 1.0, center_y], [0.0, 0.0, 1.0]])
+    reset = tf.convert_to_tensor([[1.0, 0.0, -center_x], [0.0, 1.0, -center_y], [0.0, 0.0, 1.0]])
+    m = offset @ rotation @ shift @ shearing @ zoom @ reset @ flip
+
+    transforms = tf.concat([m[:, 0, :], m[:, 1, :], tf.stack([zeros, zeros], axis=1)], axis=1)
+    return tf.raw_ops.ImageProjectiveTransformV3(
+        images=images,
+        transforms=transforms,
+        output_shape=shape[1:3],
+        fill_value=0.0,
+        interpolation='BILINEAR',
+        fill_mode='NEAREST'
+    )
+
+def augment_batch(images, augmentation=AUGMENTATION):
+    """Apply independently drawn AUGMENTATION to every image of a batch inside the graph"""
+    shape = tf.shape(images)
+    return apply_augmentation(images, sample_augmentation(shape[0], shape[1], shape[2], augmentation))
+
+def graph_dataset(filepaths, classes, num_classes, img_size, batch_size, augment=False, shuffle=False):
+    """tf.data pipeline of (image, one-hot label) batches scaled to [0, 1]
+
+    Files are decoded and resized (nearest, like load_img) in parallel map
+    calls and augmentation runs per batch, so all of it uses TensorFlow's
+    thread pool instead of one Python thread.
+    """
+    labels = np.eye(num_classes, dtype=np.float32)[np.asarray(classes)]
+
+    def load(path, label):
+        image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        image = tf.image.resize(image, img_size, method='nearest')
+        return tf.cast(image, tf.float32), label
+
+    dataset = tf.data.Dataset.from_tensor_slices((list(filepaths), labels))
+    if shuffle:
+        dataset = dataset.shuffle(len(labels), reshuffle_each_iteration=True)
+    dataset = dataset.map(load, num_parallel_calls=tf.data.AUTOTUNE).batch(batch_size)
+    if augment:
+        dataset = dataset.map(lambda x, y: (augment_batch(x), y), num_parallel_calls=tf.data.AUTOTUNE)
+    dataset = dataset.map(lambda x, y: (x / 255.0, y), num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+# Keras dtype policy for each supported compute precision
+PRECISION_POLICIES = {'float32': 'float32', 'bfloat16': 'mixed_bfloat16'}
+
+def with_precision(model, precision):
+    """Rebuild a model so every layer computes in `precision`, keeping the softmax output in float32
+
+    Weights are copied unchanged; mixed-precision layers keep float32 variables.
+    """
+    policy = PRECISION_POLICIES[precision]
+    config = model.get_config()
+    outputs = {name for name, _, _ in config.get('output_layers', [])} or {config['layers'][-1]['config']['name']}
+    
+    def rewrite(layer_configs, top_level):
+        for layer in layer_configs:
+            if layer['class_name'] == 'InputLayer':
+                continue
+            if 'dtype' in layer['config']:
+                is_output = top_level and layer['config']['name'] in outputs
+                layer['config']['dtype'] = 'float32' if is_output else policy
+            if 'layers' in layer['config']:
+                rewrite(layer['config']['layers'], False)
+    
+    rewrite(config['layers'], True)
+    rebuilt = model.__class__.from_config(config)
+    rebuilt.set_weights(model.get_weights())
+    return rebuilt
+
+def model_precision(model):
+    """'bfloat16' if any layer computes in mixed bfloat16, else 'float32'"""
+    for layer in model.submodules:
+        if isinstance(layer, layers.Layer) and layer.dtype_policy.name == 'mixed_bfloat16':
+            return 'bfloat16'
+    return 'float32'
+
+# Progressive resizing: (image side, share of the phase's epochs), ending at the full img_size
+PROGRESSIVE_STAGES = [(128, 0.4), (160, 0.3), (224, 0.3)]
+
+# Quality gate limits; 'reject' issues skip inference, 'flag' issues only warn
+QUALITY_THRESHOLDS = {
+    'min_side': 128,            # reject: shorter side of the original upload in pixels
+    'reject_blur': 15.0,        # reject: Laplacian variance below this is unusable
+    'flag_blur': 60.0,          # flag: noticeably soft
+    'reject_dark_mean': 25.0,   # reject: mean luminance of a nearly black photo
+    'reject_bright_mean': 240.0,
+    'flag_clipped': 0.4,        # flag: fraction of crushed or blown-out pixels
+    'flag_skin_ratio': 0.05,    # flag: almost no skin-coloured pixels
+}
+
+def check_image_quality(image, analysis_side=256, thresholds=QUALITY_THRESHOLDS):
+    """Score blur, exposure, resolution and skin coverage on a small copy of a PIL image
+
+    Everything is computed with whole-array operations on a copy whose longer
+    side is `analysis_side`, so the check costs a few milliseconds.
+    """
+    width, height = image.size
+    small = image.convert('RGB')
+    small.thumbnail((analysis_side, analysis_side))
+    rgb = np.asarray(small)
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    
+    scores = {
+        'resolution': (width, height),
+        'blur': float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+        'brightness': float(gray.mean()),
+        'clipped': float(np.mean((gray < 10) | (gray > 245))),
+        'skin_ratio': float(skin_mask(rgb).mean())
+    }
+    
+    rejected, flagged = [], []
+    if min(width, height) < thresholds['min_side']:
+        rejected.append(f"The image is too small ({width}x{height} pixels)")
+    if scores['brightness'] < thresholds['reject_dark_mean']:
+        rejected.append("The image is almost completely dark")
+    elif scores['brightness'] > thresholds['reject_bright_mean']:
+        rejected.append("The image is heavily over-exposed")
+    elif scores['clipped'] > thresholds['flag_clipped']:
+        flagged.append("Large areas are too dark or too bright")
+    if scores['blur'] < thresholds['reject_blur']:
+        rejected.append("The image is too blurry to analyze")
+    elif scores['blur'] < thresholds['flag_blur']:
+        flagged.append("The image looks out of focus")
+    if scores['skin_ratio'] < thresholds['flag_skin_ratio']:
+        flagged.append("Little or no skin is visible")
+    
+    return {'usable': not rejected, 'rejected': rejected, 'flagged': flagged, 'scores': scores}
+
+def load_image_reduced(source, max_side=1344):
+    """Decode an image no larger than max_side, letting JPEG decode at reduced scale
+
+    draft() makes the JPEG decoder produce 1/2, 1/4 or 1/8 scale output directly,
+    so a 12+ megapixel photo never has to be materialized at full size.
+    """
+    image = Image.open(source)
+    image.draft('RGB', (max_side, max_side))
+    image = image.convert('RGB')
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side))
+    return image
+
+def render_cam_overlay(image, cam, alpha=0.4):
+    """Blend a [0, 1] class-activation map over a PIL image as a JET heatmap"""
+    rgb = np.array(image.convert('RGB'))
+    heatmap = cv2.resize(cam.astype(np.float32), (rgb.shape[1], rgb.shape[0]), interpolation=cv2.INTER_CUBIC)
+    heatmap = cv2.applyColorMap(np.uint8(255 * np.clip(heatmap, 0, 1)), cv2.COLORMAP_JET)
+    heatmap = cv2.cvtColor(heatmap, cv2.COLOR_BGR2RGB)
+    return Image.fromarray(cv2.addWeighted(rgb, 1 - alpha, heatmap, alpha, 0))
+
+# Test-time augmentation views, most useful first: (name, crop box as fractions, flip)
+TTA_VIEWS = [
+    ('identity', (0.0, 0.0, 1.0, 1.0), None),
+    ('hflip', (0.0, 0.0, 1.0, 1.0), 'h'),
+    ('center-85', (0.075, 0.075, 0.925, 0.925), None),
+    ('vflip', (0.0, 0.0, 1.0, 1.0), 'v'),
+    ('top-left-85', (0.0, 0.0, 0.85, 0.85), None),
+    ('top-right-85', (0.15, 0.0, 1.0, 0.85), None),
+    ('bottom-left-85', (0.0, 0.15, 0.85, 1.0), None),
+    ('bottom-right-85', (0.15, 0.15, 1.0, 1.0), None),
+    ('center-70', (0.15, 0.15, 0.85, 0.85), None),
+]
+
+STUDENT_BACKBONES = {
+    'mobilenetv3small': MobileNetV3Small,
+    'mobilenetv3large': MobileNetV3Large,
+    'efficientnetb0': EfficientNetB0,
+}
+
+def distillation_loss(num_classes, temperature=4.0, alpha=0.3):
+    """Blend hard-label cross-entropy with the softened teacher distribution
+
+    y_true carries the one-hot label followed by the cached teacher logits.
+    """
+    def loss(y_true, y_pred):
+        labels = y_true[:, :num_classes]
+        teacher_logits = y_true[:, num_classes:]
+        hard = tf.keras.losses.categorical_crossentropy(labels, y_pred)
+        
+        # The student ends in a softmax, so its log-probabilities act as logits
+        student_logits = tf.math.log(tf.clip_by_value(y_pred, 1e-7, 1.0))
+        soft_teacher = tf.nn.softmax(teacher_logits / temperature)
+        soft_student = tf.nn.log_softmax(student_logits / temperature)
+        soft = -tf.reduce_sum(soft_teacher * soft_student, axis=-1) * temperature ** 2
+        return alpha * hard + (1 - alpha) * soft
+    return loss
+
+def hard_label_accuracy(num_classes):
+    """Accuracy against the one-hot part of a distillation target"""
+    def accuracy(y_true, y_pred):
+        return tf.keras.metrics.categorical_accuracy(y_true[:, :num_classes], y_pred)
+    return accuracy
+
+class AccumulatingModel(tf.keras.Model):
+    """Train `inner` with gradients averaged over `steps` micro-batches before each update
+
+    Only one micro-batch of activations is in memory at a time while every
+    optimizer step sees the gradient of a batch `steps` times larger.
+    BatchNormalization statistics still come from single micro-batches.
+    """
+    
+    def __init__(self, inner, steps):
+        super().__init__()
+        self.inner = inner
+        self.steps = steps
+        self.micro_step = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.accumulated = []
+    
+    def call(self, inputs, training=False):
+        return self.inner(inputs, training=training)
+    
+    def compile(self, *args, **kwargs):
+        super().compile(*args, **kwargs)
+        # The set of trainable variables changes between phases, so accumulators follow compile()
+        trainable = self.inner.trainable_variables
+        self.accumulated = [tf.Variable(tf.zeros_like(v), trainable=False) for v in trainable]
+        self.micro_step.assign(0)
+        # Optimizer slots can't be created lazily inside the tf.cond of train_step
+        self.optimizer._create_all_weights(trainable)
+    
+    def save(self, *args, **kwargs):
+        # Checkpoints of the wrapper are checkpoints of the classifier
+        return self.inner.save(*args, **kwargs)
+    
+    def _apply_accumulated(self):
+        self.optimizer.apply_gradients(zip(self.accumulated, self.inner.trainable_variables))
+        for accumulated in self.accumulated:
+            accumulated.assign(tf.zeros_like(accumulated))
+        return tf.constant(True)
+    
+    def train_step(self, data):
+        x, y, sample_weight = tf.keras.utils.unpack_x_y_sample_weight(data)
+        with tf.GradientTape() as tape:
+            y_pred = self.inner(x, training=True)
+            loss = self.compiled_loss(y, y_pred, sample_weight, regularization_losses=self.inner.losses)
+        gradients = tape.gradient(loss, self.inner.trainable_variables)
+        for accumulated, gradient in zip(self.accumulated, gradients):
+            accumulated.assign_add(gradient / self.steps)
+        self.micro_step.assign_add(1)
+        tf.cond(self.micro_step % self.steps == 0, self._apply_accumulated, lambda: tf.constant(False))
+        self.compiled_metrics.update_state(y, y_pred, sample_weight)
+        return {metric.name: metric.result() for metric in self.metrics}
+
+class DistillationSequence(tf.keras.utils.Sequence):
+    """Batches of images paired with their label and cached teacher logits"""
+    
+    def __init__(self, filepaths, classes, teacher_logits, num_classes, img_size,
+                 batch_size=32, augmenter=None, shuffle=True):
+        self.filepaths = np.asarray(filepaths)
+        self.targets = np.concatenate([
+            np.eye(num_classes, dtype=np.float32)[classes],
+            teacher_logits.astype(np.float32)
+        ], axis=1)
+        self.img_size = img_size
+        self.batch_size = batch_size
+        self.augmenter = augmenter
+        self.shuffle = shuffle
+        self.indices = np.arange(len(self.filepaths))
+        self.on_epoch_end()
+        
+    def __len__(self):
+        return int(np.ceil(len(self.indices) / self.batch_size))
+    
+    def __getitem__(self, idx):
+        batch = self.indices[idx * self.batch_size:(idx + 1) * self.batch_size]
+        images = []
+        for i in batch:
+            img = tf.keras.preprocessing.image.load_img(self.filepaths[i], target_size=self.img_size)
+            img = np.array(img, dtype=np.float32)
+            if self.augmenter is not None:
+                img = self.augmenter.random_transform(img)
+            images.append(img / 255.0)
+        return np.stack(images), self.targets[batch]
+    
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.indices)
+
 class SkinDiseaseDetector:
     def __init__(self, img_size=(224, 224)):
         self.img_size = img_size
@@ -21,6 +389,29 @@ class SkinDiseaseDetector:
         self.class_names = []
         self.model = None
         self.history = None
+        self.policy = None
+        self.fast_model = None
+        self.feature_extractor = None
+        self.heads = {}
+        self.explain_top_k = 3
+        self.mc_samples = 0
+        self.tta_view_cost = None
+        self.cascade_threshold = 0.8
+        self.cascade_report_every = 100
+        self._backbone_digest = None
+        self.cascade_stats = {'requests': 0, 'escalated': 0, 'escalated_agreed': 0}
+        self.hparams = dict(DEFAULT_HPARAMS)
+        self.precision = 'float32'
+        self.accumulate_steps = 1
+        self.graph_augmentation = False
+        self.trainer = None
+        self.strategy = None
+        self.num_workers = 1
+        self.worker_index = 0
+        self.is_chief = True
+        self.budget_exhausted = False
+        self.profiler = None
+        self.telemetry = None
         self.train_path = 'dataset/train'
         self.test_path = 'dataset/test'
         
@@ -31,19 +422,27 @@ class SkinDiseaseDetector:
         print(f"Loaded {self.num_classes} classes: {self.class_names}")
         return self.class_names
     
+    def set_precision(self, precision='bfloat16'):
+        """Build every later model in `precision`; 'bfloat16' runs convolutions and dense layers in
+        bfloat16 (AVX-512 BF16 / AMX through oneDNN) while variables and the softmax stay float32"""
+        tf.keras.mixed_precision.set_global_policy(PRECISION_POLICIES[precision])
+        self.precision = precision
+        print(f"Compute precision: {precision}")
+    
+    def load_hparams(self, path):
+        """Override the default hyperparameters with the values in a JSON file"""
+        with open(path) as f:
+            self.hparams.update(json.load(f))
+        print(f"Hyperparameters: {self.hparams}")
+        return self.hparams
+    
     def create_data_generators(self, batch_size=32):
         """Create data generators for training and validation"""
         # Data augmentation for training
         train_datagen = ImageDataGenerator(
             rescale=1./255,
-            rotation_range=20,
-            width_shift_range=0.2,
-            height_shift_range=0.2,
-            shear_range=0.2,
-            zoom_range=0.2,
-            horizontal_flip=True,
-            fill_mode='nearest',
-            validation_split=0.2
+            validation_split=0.2,
+            **AUGMENTATION
         )
         
         # Only rescaling for validation
@@ -86,42 +485,368 @@ class SkinDiseaseDetector:
         print(f"Validation samples: {self.val_generator.samples}")
         print(f"Test samples: {self.test_generator.samples}")
         
-    def build_model(self):
-        """Build the CNN model using transfer learning with ResNet50V2"""
+    def enable_distributed(self, kind='multi-worker'):
+        """Train under a tf.distribute strategy; call this before any other TensorFlow work
+
+        'multi-worker' joins the cluster described by TF_CONFIG, 'mirrored' uses
+        every device of this machine.
+        """
+        if kind == 'multi-worker':
+            self.strategy = tf.distribute.MultiWorkerMirroredStrategy()
+            tf_config = json.loads(os.environ.get('TF_CONFIG', '{}'))
+            cluster = tf_config.get('cluster', {})
+            task = tf_config.get('task', {})
+            self.num_workers = len(cluster.get('worker', [])) + len(cluster.get('chief', [])) or 1
+            self.worker_index = task.get('index', 0)
+            # Without an explicit chief, worker 0 writes checkpoints and plots
+            self.is_chief = (task.get('type') == 'chief' or
+                             ('chief' not in cluster and task.get('index', 0) == 0))
+        else:
+            self.strategy = tf.distribute.MirroredStrategy()
+        print(f"Distributed training over {self.strategy.num_replicas_in_sync} replicas "
+              f"on {self.num_workers} worker(s)" + (" (chief)" if self.is_chief else ""))
+        return self.strategy
+    
+    def _scope(self):
+        return (self.strategy or tf.distribute.get_strategy()).scope()
+    
+    def _learning_rate(self, base_rate):
+        """Scale a single-replica learning rate linearly with the number of replicas"""
+        if self.strategy is None:
+            return base_rate
+        return base_rate * self.strategy.num_replicas_in_sync
+    
+    def create_distributed_datasets(self, batch_size=32):
+        """Shard the training and validation files across workers as tf.data pipelines
+
+        Call after create_data_generators(). `batch_size` is per replica, so the
+        global batch grows with the cluster. Every input pipeline keeps its own
+        slice of the file list, so no two workers decode the same image, and
+        tf.data auto-sharding is switched off because the files are already split.
+        """
+        replicas = self.strategy.num_replicas_in_sync
+        global_batch = batch_size * replicas
+        class_names = sorted(self.train_generator.class_indices, key=self.train_generator.class_indices.get)
+        signature = (
+            tf.TensorSpec((None, *self.img_size, 3), tf.float32),
+            tf.TensorSpec((None, len(class_names)), tf.float32)
+        )
+        
+        def dataset_creator(source, datagen_kwargs, shuffle):
+            files = pd.DataFrame({
+                'filename': source.filepaths,
+                'class': [class_names[c] for c in source.classes],
+                'label': source.classes
+            })
+            
+            def dataset_fn(input_context):
+                shard = files.iloc[input_context.input_pipeline_id::input_context.num_input_pipelines]
+                options = tf.data.Options()
+                options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+                if self.graph_augmentation:
+                    # Repeated because fit() runs a fixed number of steps per epoch
+                    dataset = graph_dataset(shard['filename'], shard['label'], len(class_names), self.img_size,
+                                            input_context.get_per_replica_batch_size(global_batch),
+                                            augment=bool(datagen_kwargs), shuffle=shuffle)
+                    return dataset.repeat().with_options(options)
+                iterator = ImageDataGenerator(rescale=1./255, **datagen_kwargs).flow_from_dataframe(
+                    shard,
+                    x_col='filename',
+                    y_col='class',
+                    classes=class_names,
+                    target_size=self.img_size,
+                    batch_size=input_context.get_per_replica_batch_size(global_batch),
+                    class_mode='categorical',
+                    shuffle=shuffle
+                )
+                dataset = tf.data.Dataset.from_generator(lambda: iterator, output_signature=signature)
+                return dataset.with_options(options).prefetch(tf.data.AUTOTUNE)
+            
+            return tf.keras.utils.experimental.DatasetCreator(dataset_fn)
+        
+        self.train_dataset = dataset_creator(self.train_generator, AUGMENTATION, shuffle=True)
+        self.val_dataset = dataset_creator(self.val_generator, {}, shuffle=False)
+        # Every worker must run the same number of steps
+        self.steps_per_epoch = math.ceil(self.train_generator.samples / global_batch)
+        self.validation_steps = math.ceil(self.val_generator.samples / global_batch)
+        print(f"Global batch size {global_batch} ({batch_size} per replica), "
+              f"{self.steps_per_epoch} steps per epoch")
+    
+    def create_graph_datasets(self, batch_size=32):
+        """Single-process tf.data pipelines over the generators' files, augmenting whole batches in-graph
+
+        Call after create_data_generators(). The training pipeline applies
+        AUGMENTATION through augment_batch() instead of ImageDataGenerator;
+        `check-augmentation` compares the two.
+        """
+        num_classes = len(self.train_generator.class_indices)
+        self.train_dataset = graph_dataset(self.train_generator.filepaths, self.train_generator.classes,
+                                           num_classes, self.img_size, batch_size, augment=True, shuffle=True)
+        self.val_dataset = graph_dataset(self.val_generator.filepaths, self.val_generator.classes,
+                                         num_classes, self.img_size, batch_size)
+        print(f"In-graph augmentation: tf.data pipelines over {self.train_generator.samples} training files")
+    
+    def check_augmentation_parity(self, samples=32, repeats=20, seed=0):
+        """Compare augment_batch() with ImageDataGenerator on training images; returns True if they agree
+
+        First both apply the same sampled parameters, which has to give nearly
+        the same pixels. Then each draws its own parameters `repeats` times per
+        image and the intensity histograms and per-channel statistics of the
+        two sets of outputs are compared.
+        """
+        np.random.seed(seed)
+        tf.random.set_seed(seed)
+        filepaths = np.random.choice(self.train_generator.filepaths,
+                                     size=min(samples, self.train_generator.samples), replace=False)
+        images = np.stack([
+            np.array(tf.keras.preprocessing.image.load_img(path, target_size=self.img_size), dtype=np.float32)
+            for path in filepaths
+        ])
+        datagen = ImageDataGenerator(**AUGMENTATION)
+        
+        # Same parameters through both implementations
+        params = sample_augmentation(len(images), *self.img_size)
+        reference = np.stack([
+            datagen.apply_transform(image, {
+                'theta': float(params['theta'][i]), 'tx': float(params['tx'][i]), 'ty': float(params['ty'][i]),
+                'shear': float(params['shear'][i]), 'zx': float(params['zx'][i]), 'zy': float(params['zy'][i]),
+                'flip_horizontal': bool(params['flip'][i])
+            })
+            for i, image in enumerate(images)
+        ])
+        warped = apply_augmentation(tf.constant(images), params).numpy()
+        pixel_error = float(np.abs(reference - warped).mean())
+        
+        # Independent random draws
+        keras_out = np.stack([datagen.random_transform(image) for _ in range(repeats) for image in images])
+        graph_out = np.concatenate([augment_batch(tf.constant(images)).numpy() for _ in range(repeats)])
+        bins = np.linspace(0, 255, 33)
+        keras_hist = np.histogram(keras_out, bins=bins)[0] / keras_out.size
+        graph_hist = np.histogram(graph_out, bins=bins)[0] / graph_out.size
+        histogram_distance = float(0.5 * np.abs(keras_hist - graph_hist).sum())
+        # Accumulated in float64; float32 sums over this many pixels drift by several levels
+        mean_gap = float(np.abs(keras_out.mean(axis=(0, 1, 2), dtype=np.float64)
+                                - graph_out.mean(axis=(0, 1, 2), dtype=np.float64)).max())
+        std_gap = float(np.abs(keras_out.std(axis=(0, 1, 2), dtype=np.float64)
+                               - graph_out.std(axis=(0, 1, 2), dtype=np.float64)).max())
+        
+        passed = pixel_error < 1.0 and histogram_distance < 0.02 and mean_gap < 2.0 and std_gap < 2.0
+        print(f"\nAugmentation parity on {len(images)} images ({repeats} draws each):")
+        print(f"Same parameters: mean absolute pixel difference {pixel_error:.3f} (limit 1.0)")
+        print(f"Random draws: histogram distance {histogram_distance:.4f} (limit 0.02), "
+              f"channel mean gap {mean_gap:.2f}, channel std gap {std_gap:.2f} (limits 2.0)")
+        print("PASSED" if passed else "FAILED")
+        return passed
+    
+    def _fit_inputs(self):
+        if self.strategy is None and not self.graph_augmentation:
+            # The iterator reshuffles its samples every epoch; keeping its batch order
+            # makes a position inside the epoch meaningful for resuming
+            return {'x': self._timed(self.train_generator), 'validation_data': self.val_generator, 'shuffle': False}
+        if self.strategy is None:
+            return {'x': self.train_dataset, 'validation_data': self.val_dataset}
+        return {
+            'x': self.train_dataset,
+            'validation_data': self.val_dataset,
+            'steps_per_epoch': self.steps_per_epoch,
+            'validation_steps': self.validation_steps
+        }
+    
+    def _timed(self, sequence):
+        return TimedSequence(sequence, self.profiler) if self.profiler is not None else sequence
+    
+    def finish_distributed(self):
+        """Copy the trained weights into a plain single-process model for evaluation and saving"""
+        if self.strategy is None:
+            return
+        model = tf.keras.models.clone_model(self.model)
+        model.set_weights(self.model.get_weights())
+        model.compile(
+            optimizer=optimizers.legacy.Adam(learning_rate=self.hparams['fine_tune_learning_rate']),
+            loss='categorical_crossentropy',
+            metrics=['accuracy']
+        )
+        self.model = model
+        self.strategy = None
+        
+    def create_network(self, img_size=None, weights='imagenet'):
+        """Create the uncompiled ResNet50V2 classifier for the given input size"""
+        img_size = img_size or self.img_size
+        
         # Load pre-trained ResNet50V2 model
         base_model = ResNet50V2(
-            weights='imagenet',
+            weights=weights,
             include_top=False,
-            input_shape=(*self.img_size, 3)
+            input_shape=(*img_size, 3)
         )
         
         # Freeze the base model layers
         base_model.trainable = False
         
-        # Create the model
-        self.model = models.Sequential([
-            base_model,
-            layers.GlobalAveragePooling2D(),
-            layers.Dropout(0.5),
-            layers.Dense(512, activation='relu'),
-            layers.Dropout(0.3),
-            layers.Dense(256, activation='relu'),
-            layers.Dropout(0.2),
-            layers.Dense(self.num_classes, activation='softmax')
-        ])
+        return models.Sequential([base_model, layers.GlobalAveragePooling2D()] + self._head_layers())
         
-        # Compile the model
-        self.model.compile(
-            optimizer=optimizers.legacy.Adam(learning_rate=0.001),
+    def _head_layers(self):
+        # One more dropout rate than hidden layers: the last one feeds the softmax
+        head = []
+        for rate, units in zip(self.hparams['dropout'], self.hparams['dense_units']):
+            head += [layers.Dropout(rate), layers.Dense(units, activation='relu')]
+        # The softmax output stays float32 under mixed precision
+        return head + [
+            layers.Dropout(self.hparams['dropout'][-1]),
+            layers.Dense(self.num_classes, activation='softmax', dtype='float32')
+        ]
+        
+    def create_head(self, feature_dim=2048):
+        """Create the dense classification head on its own, taking pooled backbone features"""
+        return models.Sequential([layers.InputLayer(input_shape=(feature_dim,))] + self._head_layers())
+        
+    def _build_trainer(self):
+        """The model fit() runs on: the classifier itself, or a gradient-accumulating wrapper"""
+        self.trainer = self.model
+        if self.accumulate_steps > 1:
+            with self._scope():
+                self.trainer = AccumulatingModel(self.model, self.accumulate_steps)
+                self.trainer.compile(optimizer=self.model.optimizer, loss=self.model.loss, metrics=['accuracy'])
+        
+    def build_model(self, flexible=False):
+        """Build the CNN model using transfer learning with ResNet50V2
+
+        A `flexible` model accepts any image size, which progressive resizing needs.
+        """
+        # Create and compile the model, with its variables mirrored when distributed
+        with self._scope():
+            self.model = self.create_network(img_size=(None, None) if flexible else None)
+            self.model.compile(
+                optimizer=optimizers.legacy.Adam(learning_rate=self._learning_rate(self.hparams['learning_rate'])),
+                loss='categorical_crossentropy',
+                metrics=['accuracy']
+            )
+        self._build_trainer()
+        
+        print("Model Summary:")
+        self.model.summary()
+        
+    def train_model(self, epochs=50, checkpoint_dir=None, resume=False, deadline=None,
+                    profile_dir=None, trace_steps=None, telemetry_path=None):
+        """Train the model with callbacks
+
+        With `checkpoint_dir` the full training state is checkpointed every
+        epoch; `resume` continues from the latest checkpoint there and
+        `deadline` (a time.time() value) stops training cleanly before it.
+        `profile_dir` records where step time goes and writes a bottleneck
+        summary for each phase there. `telemetry_path` streams live metrics
+        to a JSON-lines file.
+        """
+        callbacks = self._training_callbacks()
+        stateful = list(callbacks)
+        # After ReduceLROnPlateau so an epoch record shows the reduced rate
+        callbacks += self._telemetry_callbacks(telemetry_path)
+        
+        resumable = None
+        progress = None
+        if checkpoint_dir:
+            write_dir = checkpoint_dir if self.is_chief else os.path.join(checkpoint_dir, f'worker-{self.worker_index}')
+            # Last in the list so it saves the other callbacks' state after they update it
+            resumable = ResumableCheckpoint(checkpoint_dir, stateful, write_directory=write_dir,
+                                            deadline=deadline)
+            callbacks.append(resumable)
+            if resume:
+                progress = read_progress(checkpoint_dir)
+        self.budget_exhausted = False
+        
+        if profile_dir:
+            self.profiler = StepProfiler(profile_dir, trace_steps, append=progress is not None)
+            callbacks.insert(0, self.profiler)
+        
+        # Train the model
+        if progress is None or progress[0] == 0:
+            self.history = self._fit_phase(0, epochs, callbacks, resumable, progress)
+            if self.budget_exhausted:
+                return
+        
+        # Fine-tuning: Unfreeze some layers and train with lower learning rate
+        self._unfreeze_for_fine_tuning()
+        
+        # Continue training
+        if progress is None or progress[0] <= 1:
+            self.history_fine = self._fit_phase(1, 20, callbacks, resumable, progress)
+        else:
+            # Both phases already finished; only the final weights are needed
+            resumable.begin_phase(progress[0], self.trainer)
+            resumable.restore()
+        
+    def train_progressive(self, epochs=30, batch_size=32, stages=PROGRESSIVE_STAGES, telemetry_path=None):
+        """Train both phases with the image size growing stage by stage up to img_size
+
+        Each stage gets its share of the phase's epochs. Smaller images get a
+        proportionally larger batch (at most 4x) so a step costs about the same,
+        and weaker augmentation because there is less detail to regularize.
+        Validation always runs at the full img_size so the stages compare. Needs
+        a model from build_model(flexible=True); afterwards self.model is a
+        fixed img_size copy of it.
+        """
+        callbacks = self._training_callbacks() + self._telemetry_callbacks(telemetry_path)
+        self.history = self._fit_stages(epochs, batch_size, stages, callbacks)
+        self._unfreeze_for_fine_tuning()
+        if self.telemetry is not None:
+            self.telemetry.phase = 1
+        self.history_fine = self._fit_stages(20, batch_size, stages, callbacks)
+        
+        # Serve and save a fixed img_size network; converters and TFLite need static input shapes
+        fixed = self.create_network(weights=None)
+        fixed.set_weights(self.model.get_weights())
+        fixed.compile(
+            optimizer=optimizers.legacy.Adam(learning_rate=self.hparams['fine_tune_learning_rate']),
             loss='categorical_crossentropy',
             metrics=['accuracy']
         )
+        self.model = fixed
+        self._build_trainer()
         
-        print("Model Summary:")
-        self.model.summary()
+    def _fit_stages(self, epochs, batch_size, stages, callbacks):
+        # One phase, one patience: stage fits continue the early-stopping and LR-plateau counters
+        callbacks = callbacks + [CarryState(callbacks)]
+        full = self.img_size[0]
+        smallest = stages[0][0]
+        histories = []
+        epoch = 0
+        for i, (side, share) in enumerate(stages):
+            # The last stage takes whatever epochs are left
+            stage_epochs = round(share * epochs) if i < len(stages) - 1 else epochs - epoch
+            if stage_epochs <= 0:
+                continue
+            stage_batch = max(batch_size, min(4 * batch_size, int(batch_size * (full / side) ** 2) // 8 * 8))
+            strength = 1.0 if full == smallest else 0.5 + 0.5 * (side - smallest) / (full - smallest)
+            augmentation = dict(AUGMENTATION)
+            for key in ('rotation_range', 'width_shift_range', 'height_shift_range', 'shear_range', 'zoom_range'):
+                augmentation[key] = AUGMENTATION[key] * strength
+            generator = ImageDataGenerator(rescale=1./255, validation_split=0.2, **augmentation).flow_from_directory(
+                self.train_path,
+                target_size=(side, side),
+                batch_size=stage_batch,
+                class_mode='categorical',
+                subset='training',
+                shuffle=True
+            )
+            if self.telemetry is not None:
+                self.telemetry.batch_size = stage_batch
+            print(f"\nStage {i + 1}/{len(stages)}: {side}x{side}, batch {stage_batch}, "
+                  f"augmentation x{strength:.2f}, epochs {epoch + 1}-{epoch + stage_epochs}")
+            histories.append(self.trainer.fit(
+                generator,
+                validation_data=self.val_generator,
+                epochs=epoch + stage_epochs,
+                initial_epoch=epoch,
+                callbacks=callbacks,
+                verbose=1
+            ))
+            epoch += stage_epochs
+            if self.trainer.stop_training:
+                break
+        return merge_histories(histories)
         
-    def train_model(self, epochs=50):
-        """Train the model with callbacks"""
+    def _training_callbacks(self):
+        """Early stopping, LR reduction on plateau and best-model checkpoints"""
         # Callbacks
         early_stopping = EarlyStopping(
             monitor='val_loss',
@@ -138,6 +863,8 @@ class SkinDiseaseDetector:
             verbose=1
         )
         
+        # Every worker has to save: reading the BatchNorm statistics is a cross-worker
+        # collective. Keras sends non-chief writes to temporary paths and deletes them.
         checkpoint = ModelCheckpoint(
             'best_skin_disease_model.keras',
             monitor='val_accuracy',
@@ -145,39 +872,84 @@ class SkinDiseaseDetector:
             verbose=1
         )
         
-        # Train the model
-        self.history = self.model.fit(
-            self.train_generator,
-            epochs=epochs,
-            validation_data=self.val_generator,
-            callbacks=[early_stopping, reduce_lr, checkpoint],
-            verbose=1
-        )
+        return [early_stopping, reduce_lr, checkpoint]
         
-        # Fine-tuning: Unfreeze some layers and train with lower learning rate
+    def _telemetry_callbacks(self, telemetry_path):
+        """A TelemetryLogger on the chief when `telemetry_path` is set"""
+        self.telemetry = None
+        if not telemetry_path or not self.is_chief:
+            return []
+        batch_size = self.train_generator.batch_size
+        if self.strategy is not None:
+            batch_size *= self.strategy.num_replicas_in_sync
+        self.telemetry = TelemetryLogger(telemetry_path, batch_size=batch_size)
+        return [self.telemetry]
+        
+    def _unfreeze_for_fine_tuning(self):
         print("\nStarting fine-tuning...")
         base_model = self.model.layers[0]
         base_model.trainable = True
         
-        # Freeze the first 100 layers
-        for layer in base_model.layers[:100]:
+        # Freeze the first layers (100 by default)
+        for layer in base_model.layers[:self.hparams['freeze_layers']]:
             layer.trainable = False
             
         # Recompile with lower learning rate
-        self.model.compile(
-            optimizer=optimizers.legacy.Adam(learning_rate=0.0001),
-            loss='categorical_crossentropy',
-            metrics=['accuracy']
-        )
+        with self._scope():
+            self.model.compile(
+                optimizer=optimizers.legacy.Adam(
+                    learning_rate=self._learning_rate(self.hparams['fine_tune_learning_rate'])
+                ),
+                loss='categorical_crossentropy',
+                metrics=['accuracy']
+            )
+        self._build_trainer()
         
-        # Continue training
-        self.history_fine = self.model.fit(
-            self.train_generator,
-            epochs=20,
-            validation_data=self.val_generator,
-            callbacks=[early_stopping, reduce_lr, checkpoint],
-            verbose=1
-        )
+    def _fit_phase(self, phase, epochs, callbacks, resumable, progress):
+        """Run one training phase, continuing from the checkpoint in `progress` when it is this phase"""
+        initial_epoch, step = 0, 0
+        if self.profiler is not None:
+            self.profiler.begin_phase(phase)
+        if self.telemetry is not None:
+            self.telemetry.phase = phase
+        if resumable is not None:
+            sequence = None if self.strategy or self.graph_augmentation else self.train_generator
+            resumable.begin_phase(phase, self.trainer, sequence)
+            if progress is not None and progress[0] == phase:
+                initial_epoch, step = resumable.restore()
+        
+        histories = []
+        if step > 0:
+            # Finish the interrupted epoch on the batches it had not reached yet
+            resumable.batch_offset = step
+            histories.append(self.trainer.fit(
+                self._timed(EpochRemainder(self.train_generator, step)),
+                validation_data=self.val_generator,
+                epochs=initial_epoch + 1,
+                initial_epoch=initial_epoch,
+                callbacks=callbacks,
+                shuffle=False,
+                verbose=1
+            ))
+            resumable.batch_offset = 0
+            initial_epoch += 1
+        if initial_epoch < epochs and not (histories and self.trainer.stop_training):
+            histories.append(self.trainer.fit(
+                epochs=epochs,
+                initial_epoch=initial_epoch,
+                callbacks=callbacks,
+                verbose=1,
+                **self._fit_inputs()
+            ))
+        
+        if self.profiler is not None:
+            self.profiler.end_phase()
+        if resumable is not None:
+            if resumable.stopped:
+                self.budget_exhausted = True
+            else:
+                resumable.end_phase()
+        return merge_histories(histories) if histories else None
         
     def evaluate_model(self):
         """Evaluate the model on test data"""
@@ -269,36 +1041,1159 @@ class SkinDiseaseDetector:
         display_name = "Normal" if self.class_names[predicted_class] == "Normal Skin" else self.class_names[predicted_class]
         return display_name, confidence, prediction[0]
         
+    def build_student(self, architecture='mobilenetv3small', img_size=None):
+        """Create a small CPU-friendly classifier taking the same inputs as the full model"""
+        img_size = img_size or self.img_size
+        base_model = STUDENT_BACKBONES[architecture](
+            weights='imagenet',
+            include_top=False,
+            input_shape=(*img_size, 3),
+            pooling='avg'
+        )
+        
+        # Our images are scaled to [0, 1]; these backbones rescale [0, 255] inputs themselves
+        return models.Sequential([
+            layers.Rescaling(255.0, input_shape=(*img_size, 3)),
+            base_model,
+            layers.Dropout(0.2),
+            layers.Dense(self.num_classes, activation='softmax', dtype='float32')
+        ])
+        
+    def cache_teacher_logits(self, teacher, cache_path='teacher_logits.npz', teacher_path=None, batch_size=32,
+                             subset='training'):
+        """Run the teacher once over one subset of the training images and cache its logits"""
+        datagen = ImageDataGenerator(rescale=1./255, validation_split=0.2)
+        generator = datagen.flow_from_directory(
+            self.train_path,
+            target_size=self.img_size,
+            batch_size=batch_size,
+            class_mode='categorical',
+            subset=subset,
+            shuffle=False
+        )
+        filepaths = np.array(generator.filepaths)
+        teacher_mtime = os.path.getmtime(teacher_path) if teacher_path else 0.0
+        
+        if os.path.exists(cache_path):
+            cached = np.load(cache_path)
+            if np.array_equal(cached['filepaths'], filepaths) and cached['teacher_mtime'] == teacher_mtime:
+                print(f"Reusing teacher logits from {cache_path}")
+                return filepaths, generator.classes, cached['logits']
+        
+        print("Computing teacher logits (once)...")
+        probabilities = teacher.predict(generator, verbose=1)
+        logits = np.log(np.clip(probabilities, 1e-7, 1.0)).astype(np.float32)
+        np.savez(cache_path, filepaths=filepaths, logits=logits, teacher_mtime=teacher_mtime)
+        print(f"Teacher logits cached to {cache_path}")
+        return filepaths, generator.classes, logits
+        
+    def distill(self, teacher_path='skin_disease_model.h5', architecture='mobilenetv3small',
+                epochs=30, batch_size=32, temperature=4.0, alpha=0.3, cache_path='teacher_logits.npz'):
+        """Train a student model to mimic the trained full model"""
+        teacher = tf.keras.models.load_model(teacher_path)
+        filepaths, classes, logits = self.cache_teacher_logits(
+            teacher, cache_path=cache_path, teacher_path=teacher_path, batch_size=batch_size
+        )
+        # The same 20% hold-out the full model validates on
+        root, ext = os.path.splitext(cache_path)
+        val_filepaths, val_classes, val_logits = self.cache_teacher_logits(
+            teacher, cache_path=f"{root}_validation{ext}", teacher_path=teacher_path,
+            batch_size=batch_size, subset='validation'
+        )
+        
+        # Same augmentation policy as the full model, applied on the student side only
+        augmenter = ImageDataGenerator(**AUGMENTATION)
+        train_sequence = DistillationSequence(
+            filepaths, classes, logits, self.num_classes, self.img_size,
+            batch_size=batch_size, augmenter=augmenter
+        )
+        val_sequence = DistillationSequence(
+            val_filepaths, val_classes, val_logits, self.num_classes, self.img_size,
+            batch_size=batch_size, shuffle=False
+        )
+        
+        student = self.build_student(architecture)
+        student.compile(
+            optimizer=optimizers.legacy.Adam(learning_rate=0.001),
+            loss=distillation_loss(self.num_classes, temperature, alpha),
+            metrics=[hard_label_accuracy(self.num_classes)]
+        )
+        print(f"Student parameters: {student.count_params():,} (teacher: {teacher.count_params():,})")
+        
+        self.history = student.fit(
+            train_sequence,
+            validation_data=val_sequence,
+            epochs=epochs,
+            callbacks=[
+                EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True, verbose=1),
+                ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=3, min_lr=1e-7, verbose=1)
+            ],
+            verbose=1
+        )
+        
+        # Recompile with a standard loss so the H5 file loads without custom objects
+        student.compile(
+            optimizer=optimizers.legacy.Adam(learning_rate=0.0001),
+            loss='categorical_crossentropy',
+            metrics=['accuracy']
+        )
+        self.model = student
+        return teacher
+        
+    def compare_with_teacher(self, teacher):
+        """Report test accuracy, size and CPU latency of the student against the teacher"""
+        sample = self.test_generator[0][0][:1]
+        results = {}
+        for name, model in (('teacher', teacher), ('student', self.model)):
+            self.test_generator.reset()
+            _, accuracy = model.evaluate(self.test_generator, verbose=0)
+            model(sample, training=False)
+            start = time.perf_counter()
+            for _ in range(20):
+                model(sample, training=False)
+            latency = (time.perf_counter() - start) / 20
+            results[name] = {'accuracy': accuracy, 'params': model.count_params(), 'ms_per_image': latency * 1000}
+            print(f"{name}: accuracy {accuracy:.4f}, {model.count_params():,} params, {latency * 1000:.1f} ms/image")
+        print(f"Accuracy change: {results['student']['accuracy'] - results['teacher']['accuracy']:+.4f}, "
+              f"speed-up: {results['teacher']['ms_per_image'] / results['student']['ms_per_image']:.1f}x")
+        return results
+        
     def save_model(self, model_path='skin_disease_model.h5'):
         """Save the trained model in legacy H5 format"""
-        self.model.save(model_path, save_format='h5')
+        model = self.model
+        if model_precision(model) != 'float32':
+            # The H5 config records each layer's dtype policy; store a float32 model so
+            # the file loads anywhere and the precision is chosen when it is loaded
+            model = with_precision(model, 'float32')
+        model.save(model_path, save_format='h5', include_optimizer=model is self.model)
         print(f"Model saved to {model_path}")
         
-    def load_model(self, model_path='skin_disease_model.h5'):
-        self.model = tf.keras.models.load_model(model_path)
+    def load_model(self, model_path='skin_disease_model.h5', precision=None):
+        """Load a model file, package or artifact, converting it to `precision` when given"""
+        # A directory is a versioned model package and a .zst file a compressed
+        # artifact (see model_package.py)
+        if os.path.isdir(model_path) or model_path.endswith(ARTIFACT_SUFFIX):
+            if os.path.isdir(model_path):
+                self.model = load_package(model_path)
+            else:
+                self.model = load_artifact(model_path)
+            self.model.compile(
+                optimizer=optimizers.legacy.Adam(learning_rate=0.0001),
+                loss='categorical_crossentropy',
+                metrics=['accuracy']
+            )
+        else:
+            self.model = tf.keras.models.load_model(model_path)
+        if precision is not None:
+            self.set_precision(precision)
+            if model_precision(self.model) != precision:
+                self.model = with_precision(self.model, precision)
+                self.model.compile(
+                    optimizer=optimizers.legacy.Adam(learning_rate=0.0001),
+                    loss='categorical_crossentropy',
+                    metrics=['accuracy']
+                )
+        self._adopt_head_architecture()
         print(f"Model loaded from {model_path}")
+        
+    def _adopt_head_architecture(self):
+        """Take dense_units and dropout from the loaded model's head
 
-def main():
-    """Main function to train and evaluate the model"""
+        Heads and networks rebuilt later (reduced variant, add-classes) then
+        match a model trained with other --hparams than the defaults.
+        """
+        head = self.model.layers[2:]
+        dense = [layer for layer in head if isinstance(layer, layers.Dense)]
+        dropout = [layer.rate for layer in head if isinstance(layer, layers.Dropout)]
+        if not dense:
+            return
+        self.hparams['dense_units'] = [layer.units for layer in dense[:-1]]
+        if len(dropout) == len(dense):
+            self.hparams['dropout'] = dropout
+        
+    def tta_views(self, image, count):
+        """Stack the first `count` TTA views of a PIL image into one preprocessed batch"""
+        image = image.convert('RGB')
+        width, height = image.size
+        views = []
+        for _, (left, top, right, bottom), flip in TTA_VIEWS[:count]:
+            # Crop from the original resolution so crops keep their detail
+            view = image.crop((int(left * width), int(top * height), int(right * width), int(bottom * height)))
+            view = view.resize(self.img_size)
+            if flip == 'h':
+                view = view.transpose(Image.FLIP_LEFT_RIGHT)
+            elif flip == 'v':
+                view = view.transpose(Image.FLIP_TOP_BOTTOM)
+            views.append(np.array(view, dtype=np.float32) / 255.0)
+        return np.stack(views)
+        
+    def predict_tta(self, image, latency_budget=1.0, max_views=len(TTA_VIEWS), min_views=2):
+        """Average predictions over as many augmented views as fit the latency budget
+
+        All views go through the model as one batch. The per-view cost is learned
+        from previous calls, so the number of views adapts to the machine.
+        """
+        if self.tta_view_cost is None:
+            count = min_views
+        else:
+            count = int(latency_budget / self.tta_view_cost)
+        count = max(1, min(count, max_views))
+        
+        start = time.perf_counter()
+        batch = self.tta_views(image, count)
+        probabilities = self.model(batch, training=False).numpy()
+        cost = (time.perf_counter() - start) / count
+        self.tta_view_cost = cost if self.tta_view_cost is None else 0.8 * self.tta_view_cost + 0.2 * cost
+        return {'probabilities': probabilities.mean(axis=0, keepdims=True), 'views': count}
+        
+    def evaluate_tta(self, view_counts=(1, 2, 4, 6, 9)):
+        """Test accuracy and time per image for different numbers of TTA views"""
+        max_views = max(view_counts)
+        per_view = []
+        view_time = 0.0
+        for path in self.test_generator.filepaths:
+            batch = self.tta_views(Image.open(path), max_views)
+            start = time.perf_counter()
+            per_view.append(self.model(batch, training=False).numpy())
+            view_time += time.perf_counter() - start
+        per_view = np.stack(per_view)
+        y_true = self.test_generator.classes
+        ms_per_view = 1000 * view_time / (len(y_true) * max_views)
+        
+        results = {}
+        baseline = None
+        for count in view_counts:
+            # Views are ordered, so the first `count` views are what predict_tta would use
+            accuracy = float(np.mean(np.argmax(per_view[:, :count].mean(axis=1), axis=1) == y_true))
+            baseline = accuracy if baseline is None else baseline
+            results[count] = {'accuracy': accuracy, 'ms_per_image': ms_per_view * count}
+            print(f"{count} views: accuracy {accuracy:.4f} ({accuracy - baseline:+.4f}), "
+                  f"~{ms_per_view * count:.0f} ms/image")
+        return results
+        
+    def predict_tiled(self, source, max_side=1344, overlap=0.25, batch_size=16,
+                      min_skin_ratio=0.3, min_std=8.0):
+        """Predict a large photograph from overlapping full-resolution tiles
+
+        The image is decoded at no more than max_side pixels, split into
+        overlapping img_size tiles, tiles that are mostly background (few skin
+        pixels or almost flat) are dropped and the rest run in batches. Tile
+        predictions are averaged, weighted by skin coverage, and blended with a
+        whole-image prediction.
+        """
+        image = load_image_reduced(source, max_side=max_side)
+        rgb = np.asarray(image)
+        whole = np.array(image.resize(self.img_size), dtype=np.float32)[None] / 255.0
+        global_probabilities = self.model(whole, training=False).numpy()
+        
+        tile_h, tile_w = self.img_size
+        height, width = rgb.shape[:2]
+        # Nothing to gain when the image is barely larger than a tile, and no full tile fits
+        # when one side is shorter than a tile (e.g. a 1200x200 strip)
+        if height < tile_h or width < tile_w or (height < 1.5 * tile_h and width < 1.5 * tile_w):
+            return {'probabilities': global_probabilities, 'tiles': 0, 'tiles_skipped': 0}
+        
+        def starts(size, tile):
+            stride = max(1, int(tile * (1 - overlap)))
+            positions = list(range(0, max(size - tile, 0) + 1, stride))
+            if positions[-1] + tile < size:
+                positions.append(size - tile)
+            return positions
+        boxes = np.array([(y, x) for y in starts(height, tile_h) for x in starts(width, tile_w)])
+        
+        # Per-tile skin coverage and flatness from integral images, no per-tile loops
+        skin_sum = cv2.integral(skin_mask(rgb).astype(np.uint8))
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY).astype(np.float64)
+        gray_sum, gray_sq_sum = cv2.integral2(gray)
+        y0, x0 = boxes[:, 0], boxes[:, 1]
+        y1, x1 = y0 + tile_h, x0 + tile_w
+        area = tile_h * tile_w
+        
+        def box_sum(table):
+            return table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+        skin_ratio = box_sum(skin_sum) / area
+        mean = box_sum(gray_sum) / area
+        std = np.sqrt(np.maximum(box_sum(gray_sq_sum) / area - mean ** 2, 0))
+        keep = (skin_ratio >= min_skin_ratio) & (std >= min_std)
+        boxes, weights = boxes[keep], skin_ratio[keep]
+        if len(boxes) == 0:
+            return {'probabilities': global_probabilities, 'tiles': 0, 'tiles_skipped': int((~keep).sum())}
+        
+        tile_probabilities = []
+        for i in range(0, len(boxes), batch_size):
+            batch = np.stack([
+                rgb[y:y + tile_h, x:x + tile_w] for y, x in boxes[i:i + batch_size]
+            ]).astype(np.float32) / 255.0
+            tile_probabilities.append(self.model(batch, training=False).numpy())
+        tile_probabilities = np.concatenate(tile_probabilities)
+        
+        tiled = (weights[:, None] * tile_probabilities).sum(axis=0, keepdims=True) / weights.sum()
+        return {
+            'probabilities': 0.5 * (tiled + global_probabilities),
+            'tiles': len(boxes),
+            'tiles_skipped': int((~keep).sum()),
+            'tile_boxes': boxes,
+            'tile_probabilities': tile_probabilities
+        }
+        
+    def build_feature_extractor(self):
+        """Backbone plus pooling of the loaded classifier; returns the feature size"""
+        backbone, pooling = self.model.layers[:2]
+        self.feature_extractor = models.Sequential([backbone, pooling])
+        return pooling.output_shape[-1]
+        
+    def split_model(self):
+        """Split the loaded classifier into a shared feature extractor and a 'diagnosis' head"""
+        feature_dim = self.build_feature_extractor()
+        
+        # The head layers are shared with self.model, so both stay in sync
+        head = models.Sequential([layers.InputLayer(input_shape=(feature_dim,))] + self.model.layers[2:])
+        self.heads = {}
+        self.register_head('diagnosis', head, self.class_names)
+        
+    def register_head(self, name, head, class_names):
+        """Attach a classifier head (model or H5 path) that consumes the shared features"""
+        if isinstance(head, str):
+            head = tf.keras.models.load_model(head)
+        if head.output_shape[-1] != len(class_names):
+            raise ValueError(f"Head '{name}' has {head.output_shape[-1]} outputs "
+                             f"but {len(class_names)} class names")
+        # Replace rather than mutate so concurrent requests see a consistent set of heads
+        self.heads = {**self.heads, name: {'model': head, 'class_names': list(class_names)}}
+        print(f"Registered head '{name}' with {len(class_names)} classes")
+        
+    def unregister_head(self, name):
+        """Detach a previously registered head"""
+        self.heads = {key: value for key, value in self.heads.items() if key != name}
+        
+    def add_grouped_head(self, name, groups, other=None):
+        """Register a coarse head that sums diagnosis probabilities over class groups
+
+        groups maps a group name to the class names it covers; classes not listed
+        fall into the `other` group when one is given.
+        """
+        group_names = list(groups) + ([other] if other else [])
+        mapping = np.zeros((self.num_classes, len(group_names)), dtype=np.float32)
+        for i, class_name in enumerate(self.class_names):
+            for j, group in enumerate(groups):
+                if class_name in groups[group]:
+                    mapping[i, j] = 1.0
+                    break
+            else:
+                if other:
+                    mapping[i, -1] = 1.0
+        
+        diagnosis = self.heads['diagnosis']['model']
+        # Summed in float32 like the softmax it reads, or bfloat16 rounding shifts the group probabilities
+        grouping = layers.Dense(len(group_names), use_bias=False, trainable=False, dtype='float32',
+                                name=f'{name}_groups')
+        head = models.Sequential([diagnosis, grouping])
+        head.build(diagnosis.input_shape)
+        grouping.set_weights([mapping])
+        self.register_head(name, head, group_names)
+        
+    def extract_features(self, img_array):
+        """Pooled backbone features for a batch of preprocessed images"""
+        return self.feature_extractor(img_array, training=False)
+        
+    def predict_heads(self, img_array, heads=None):
+        """Run the backbone once and every requested head on the shared features"""
+        active = self.heads
+        features = self.extract_features(img_array)
+        return {
+            name: active[name]['model'](features, training=False).numpy()
+            for name in (heads or active)
+        }
+        
+    def extract_embeddings(self, img_array):
+        """Unit-length image embeddings for similar-case search"""
+        if self.feature_extractor is None:
+            self.split_model()
+        return normalize(self.extract_features(img_array).numpy())
+        
+    def _class_folders(self, strict=False):
+        """Class folders of train_path in the order of class_names.txt, for flow_from_directory(classes=...)
+
+        When the folder names are the class names they are numbered in file
+        order, so a label index always maps to the right name. Otherwise
+        class_names.txt holds display names for the sorted folders, as in
+        training; `strict` refuses that, since a line added out of order would
+        then shift every later label.
+        """
+        folders = sorted(entry for entry in os.listdir(self.train_path)
+                         if os.path.isdir(os.path.join(self.train_path, entry)))
+        if sorted(self.class_names) == folders:
+            return list(self.class_names)
+        if strict or len(folders) != self.num_classes:
+            raise ValueError(f"The class folders in {self.train_path} do not match class_names.txt; "
+                             "name one folder per line of class_names.txt")
+        return folders
+        
+    def build_embedding_index(self, directory='embeddings', batch_size=64, nlist=None):
+        """Embed every training image and store the result as a searchable index"""
+        if self.feature_extractor is None:
+            self.split_model()
+        generator = ImageDataGenerator(rescale=1./255).flow_from_directory(
+            self.train_path,
+            target_size=self.img_size,
+            batch_size=batch_size,
+            class_mode='sparse',
+            classes=self._class_folders(),
+            shuffle=False
+        )
+        batches = (
+            self.extract_features(generator[i][0]).numpy() for i in range(len(generator))
+        )
+        index = EmbeddingIndex.create(
+            directory, batches, generator.samples,
+            paths=generator.filepaths,
+            labels=[self.class_names[c] for c in generator.classes],
+            class_names=self.class_names,
+            backbone=self.backbone_digest()
+        )
+        if nlist:
+            index.train_ivf(nlist=nlist)
+        print(f"Embedding index with {len(index)} images written to {directory}")
+        return index
+        
+    def update_classes(self, index_dir='embeddings', head_path='skin_disease_head.h5',
+                       epochs=50, batch_size=64):
+        """Retrain only the dense head for the current class list from cached embeddings
+
+        Images already in the index reuse their stored features; only images that
+        are new under train_path go through the backbone. The new head is saved on
+        its own to head_path and swapped into the loaded model.
+        """
+        feature_dim = self.build_feature_extractor()
+        index = EmbeddingIndex(index_dir)
+        # A head trained on another backbone's features would never see them when serving
+        if index.backbone != self.backbone_digest():
+            raise ValueError(f"{index_dir} was not built with the loaded model's backbone; "
+                             f"rebuild it with `index --model <this model> --output {index_dir}`")
+        old_class_names = index.class_names
+        
+        # Current training images, numbered in class_names.txt order so a new line
+        # anywhere in the file keeps every other label in place
+        listing = ImageDataGenerator().flow_from_directory(
+            self.train_path, class_mode='sparse', classes=self._class_folders(strict=True), shuffle=False
+        )
+        current = set(listing.filepaths)
+        known = set(index.paths)
+        new = [(path, c) for path, c in zip(listing.filepaths, listing.classes) if path not in known]
+        
+        if new:
+            print(f"Embedding {len(new)} new images...")
+            frame = pd.DataFrame({'filename': [path for path, _ in new]})
+            generator = ImageDataGenerator(rescale=1./255).flow_from_dataframe(
+                frame,
+                x_col='filename',
+                class_mode=None,
+                target_size=self.img_size,
+                batch_size=batch_size,
+                shuffle=False,
+                validate_filenames=False
+            )
+            batches = (self.extract_features(generator[i]).numpy() for i in range(len(generator)))
+            nlist = len(index.centroids) if index.centroids is not None else 0
+            index = EmbeddingIndex.create(
+                index_dir, batches, len(new),
+                paths=[path for path, _ in new],
+                labels=[self.class_names[c] for _, c in new],
+                class_names=self.class_names,
+                existing=index
+            )
+            if nlist:
+                index.train_ivf(nlist=nlist)
+        
+        # Training rows: images still in the dataset whose label exists in the current taxonomy
+        class_lookup = {name: i for i, name in enumerate(self.class_names)}
+        ids = [i for i, (path, label) in enumerate(zip(index.paths, index.labels))
+               if path in current and label in class_lookup]
+        features = index.features(ids)
+        labels = np.array([class_lookup[index.labels[i]] for i in ids])
+        order = np.random.permutation(len(ids))
+        features, labels = features[order], labels[order]
+        print(f"Training head on {len(ids)} cached embeddings for {self.num_classes} classes")
+        
+        head = self.create_head(feature_dim)
+        self._warm_start_head(head, old_class_names)
+        head.compile(
+            optimizer=optimizers.legacy.Adam(learning_rate=0.001),
+            loss='sparse_categorical_crossentropy',
+            metrics=['accuracy']
+        )
+        self.history = head.fit(
+            features, labels,
+            epochs=epochs,
+            batch_size=batch_size,
+            validation_split=0.2,
+            callbacks=[EarlyStopping(monitor='val_loss', patience=10, restore_best_weights=True, verbose=1)],
+            verbose=1
+        )
+        
+        head.save(head_path, save_format='h5')
+        # Tie the update to this backbone so it is never applied on top of a later release
+        with h5py.File(head_path, 'a') as f:
+            f.attrs['backbone_digest'] = self.backbone_digest()
+        print(f"Head update saved to {head_path} ({os.path.getsize(head_path) / (1024*1024):.1f} MB)")
+        self.apply_head_update(head)
+        return head
+        
+    def _warm_start_head(self, head, old_class_names):
+        """Copy hidden layers and matching class rows from the current head"""
+        old_layers = [layer for layer in self.model.layers[2:] if layer.weights]
+        new_layers = [layer for layer in head.layers if layer.weights]
+        for old, new in zip(old_layers[:-1], new_layers[:-1]):
+            new.set_weights(old.get_weights())
+        
+        old_kernel, old_bias = old_layers[-1].get_weights()
+        if old_kernel.shape[1] != len(old_class_names):
+            return
+        kernel, bias = new_layers[-1].get_weights()
+        for j, name in enumerate(self.class_names):
+            if name in old_class_names:
+                i = old_class_names.index(name)
+                kernel[:, j] = old_kernel[:, i]
+                bias[j] = old_bias[i]
+        new_layers[-1].set_weights([kernel, bias])
+        
+    def apply_head_update(self, head):
+        """Replace the dense head of the loaded model with a separately trained one
+
+        A head file is only applied to the backbone it was trained on; for any
+        other base model it is skipped and False is returned.
+        """
+        if isinstance(head, str):
+            with h5py.File(head, 'r') as f:
+                trained_on = f.attrs.get('backbone_digest')
+            if trained_on != self.backbone_digest():
+                print(f"Skipping head update {head}: it was trained on a different base model")
+                return False
+            head = tf.keras.models.load_model(head)
+        if head.output_shape[-1] != self.num_classes:
+            raise ValueError(f"Head has {head.output_shape[-1]} outputs but {self.num_classes} classes are loaded")
+        backbone, pooling = self.model.layers[:2]
+        self.model = models.Sequential([backbone, pooling] + head.layers)
+        self.model.compile(
+            optimizer=optimizers.legacy.Adam(learning_rate=0.0001),
+            loss='categorical_crossentropy',
+            metrics=['accuracy']
+        )
+        if self.feature_extractor is not None:
+            self.split_model()
+        print(f"Applied head update with {self.num_classes} classes")
+        return True
+        
+    def grad_cam(self, conv_maps, probabilities, top_k=3):
+        """Grad-CAM maps for the top-k classes of each image from precomputed backbone maps
+
+        The backbone activations are tiled k times and only the dense head is
+        re-run, so one backward pass through the head yields every class map.
+        Returns (classes, cams) with shapes (N, k) and (N, k, h, w), cams in [0, 1].
+        """
+        pooling = self.model.layers[1]
+        hidden_layers = self.model.layers[2:-1]
+        output_layer = self.model.layers[-1]
+        top_k = min(top_k, probabilities.shape[1])
+        classes = np.argsort(-probabilities, axis=1)[:, :top_k]
+        
+        tiled = tf.repeat(conv_maps, top_k, axis=0)
+        with tf.GradientTape() as tape:
+            tape.watch(tiled)
+            x = pooling(tiled)
+            for layer in hidden_layers:
+                x = layer(x, training=False)
+            # Pre-softmax scores give sharper maps than the probabilities. Under mixed
+            # precision the hidden layers compute in bfloat16 while the float32 output
+            # layer keeps float32 variables
+            x = tf.cast(x, output_layer.kernel.dtype)
+            logits = tf.matmul(x, output_layer.kernel) + output_layer.bias
+            selected = tf.gather(logits, classes.reshape(-1, 1), batch_dims=1)
+        gradients = tape.gradient(selected, tiled)
+        
+        weights = tf.reduce_mean(tf.cast(gradients, tf.float32), axis=(1, 2))
+        cams = tf.nn.relu(tf.einsum('bhwc,bc->bhw', tf.cast(tiled, tf.float32), weights)).numpy()
+        cams /= np.maximum(cams.max(axis=(1, 2), keepdims=True), 1e-8)
+        return classes, cams.reshape(len(probabilities), top_k, *cams.shape[1:])
+        
+    def explain(self, img_array, top_k=3):
+        """Predict a batch and return Grad-CAM maps for its top-k classes"""
+        backbone = self.model.layers[0]
+        conv_maps = backbone(img_array, training=False)
+        x = conv_maps
+        for layer in self.model.layers[1:]:
+            x = layer(x, training=False)
+        probabilities = x.numpy()
+        classes, cams = self.grad_cam(conv_maps, probabilities, top_k)
+        return {'probabilities': probabilities, 'cam_classes': classes, 'cams': cams}
+        
+    def mc_dropout(self, features, samples=20):
+        """Monte-Carlo dropout statistics from pooled features
+
+        Each image's features are repeated `samples` times and pushed through
+        the dense head in a single batched call with dropout active, so the
+        backbone cost is paid only once.
+        """
+        features = tf.convert_to_tensor(features)
+        x = tf.repeat(features, samples, axis=0)
+        for layer in self.model.layers[2:]:
+            x = layer(x, training=True)
+        probabilities = x.numpy().reshape(len(features), samples, -1)
+        
+        mean = probabilities.mean(axis=1)
+        predictive_entropy = -np.sum(mean * np.log(mean + 1e-12), axis=1)
+        expected_entropy = -np.sum(probabilities * np.log(probabilities + 1e-12), axis=2).mean(axis=1)
+        variance = probabilities.var(axis=1)
+        top = np.argmax(mean, axis=1)
+        return {
+            'mc_probabilities': mean,
+            'entropy': predictive_entropy,
+            'normalized_entropy': predictive_entropy / np.log(mean.shape[1]),
+            'mutual_information': predictive_entropy - expected_entropy,
+            'variance': variance,
+            'top_class_variance': variance[np.arange(len(top)), top]
+        }
+        
+    def enable_uncertainty(self, samples=20):
+        """Attach MC-dropout uncertainty to every full-model prediction"""
+        self.mc_samples = samples
+        
+    def predict_uncertainty(self, img_array, samples=20):
+        """Deterministic probabilities plus MC-dropout uncertainty for a batch"""
+        if self.feature_extractor is None:
+            self.build_feature_extractor()
+        features = self.extract_features(img_array)
+        x = features
+        for layer in self.model.layers[2:]:
+            x = layer(x, training=False)
+        result = {'probabilities': x.numpy()}
+        result.update(self.mc_dropout(features, samples))
+        return result
+        
+    def evaluate_uncertainty(self, samples=20):
+        """How well each score flags misclassified test images (AUROC, higher is better)"""
+        if self.feature_extractor is None:
+            self.build_feature_extractor()
+        self.test_generator.reset()
+        results = [self.predict_uncertainty(self.test_generator[i][0], samples)
+                   for i in range(len(self.test_generator))]
+        merged = {key: np.concatenate([r[key] for r in results]) for key in results[0]}
+        errors = np.argmax(merged['probabilities'], axis=1) != self.test_generator.classes
+        
+        scores = {
+            '1 - max softmax': 1 - merged['probabilities'].max(axis=1),
+            'predictive entropy': merged['entropy'],
+            'mutual information': merged['mutual_information'],
+            'top-class variance': merged['top_class_variance']
+        }
+        report = {}
+        for name, score in scores.items():
+            report[name] = roc_auc_score(errors, score)
+            print(f"{name:>20}: error-detection AUROC {report[name]:.4f}")
+        
+        # Cost of the batched head samples relative to one full forward pass
+        batch = self.test_generator[0][0]
+        start = time.perf_counter()
+        self.model(batch, training=False)
+        full_time = time.perf_counter() - start
+        features = self.extract_features(batch)
+        start = time.perf_counter()
+        self.mc_dropout(features, samples)
+        mc_time = time.perf_counter() - start
+        print(f"{samples} dropout samples cost {mc_time / full_time:.1%} of a full forward pass")
+        return report
+        
+    def _predict_all_heads(self, img_array):
+        backbone, pooling = self.model.layers[:2]
+        conv_maps = backbone(img_array, training=False)
+        features = pooling(conv_maps)
+        outputs = {
+            name: head['model'](features, training=False).numpy()
+            for name, head in self.heads.items()
+        }
+        result = {
+            'probabilities': outputs.pop('diagnosis'),
+            'heads': outputs,
+            'embedding': normalize(features.numpy())
+        }
+        if self.mc_samples:
+            result.update(self.mc_dropout(features, self.mc_samples))
+        if self.explain_top_k:
+            # Reuses this forward pass; rendering the overlay is left to the caller
+            result['cam_classes'], result['cams'] = self.grad_cam(
+                conv_maps, result['probabilities'], self.explain_top_k
+            )
+        return result
+        
+    def enable_cascade(self, fast_model_path, threshold=0.8):
+        """Answer with a lightweight model first and escalate unsure images to the full model"""
+        self.fast_model = tf.keras.models.load_model(fast_model_path)
+        self.cascade_threshold = threshold
+        self.cascade_stats = {'requests': 0, 'escalated': 0, 'escalated_agreed': 0}
+        print(f"Cascade enabled with {fast_model_path} (threshold {threshold:.2f})")
+        
+    def predict_cascade(self, img_array):
+        """Predict a batch through the cascade, returning probabilities and the escalation mask"""
+        probabilities, escalated, _ = self._cascade(
+            img_array, lambda x: {'probabilities': self.model(x, training=False).numpy()}
+        )
+        return probabilities, escalated
+        
+    def _cascade(self, img_array, full_predict):
+        """Fast model first, full_predict (returning a result dict) on the unsure images; also returns that dict"""
+        fast_input = img_array
+        fast_size = tuple(self.fast_model.input_shape[1:3])
+        if tuple(img_array.shape[1:3]) != fast_size:
+            fast_input = tf.image.resize(img_array, fast_size).numpy()
+        probabilities = self.fast_model(fast_input, training=False).numpy()
+        
+        # Only images the fast model is unsure about pay for the full model
+        escalated = probabilities.max(axis=1) < self.cascade_threshold
+        full_result = None
+        if escalated.any():
+            full_result = full_predict(img_array[escalated])
+            full = full_result['probabilities']
+            agreed = np.argmax(probabilities[escalated], axis=1) == np.argmax(full, axis=1)
+            probabilities[escalated] = full
+            self.cascade_stats['escalated_agreed'] += int(agreed.sum())
+        self.cascade_stats['requests'] += len(img_array)
+        self.cascade_stats['escalated'] += int(escalated.sum())
+        return probabilities, escalated, full_result
+        
+    def _predict_cascade_result(self, img_array):
+        """Serve through the cascade
+
+        The student only gives probabilities, so confident fast answers come
+        without the malignancy head, MC-dropout uncertainty, Grad-CAM maps and
+        the embedding. Escalated images go through the split full model and
+        keep them when the whole batch was escalated.
+        """
+        served = self.cascade_stats['requests']
+        if self.feature_extractor is None:
+            probabilities, escalated = self.predict_cascade(img_array)
+            result = {}
+        else:
+            probabilities, escalated, full_result = self._cascade(img_array, self._predict_all_heads)
+            result = dict(full_result) if escalated.all() else {}
+        result.update(probabilities=probabilities, escalated=escalated)
+        
+        # Log the escalation fraction every cascade_report_every served images
+        every = self.cascade_report_every
+        if every and self.cascade_stats['requests'] // every > served // every:
+            report = self.cascade_report()
+            print(f"Cascade: {report['escalation_rate']:.1%} of {report['requests']} images escalated, "
+                  f"{report['escalated_agreement']:.1%} of those agreed with the fast model")
+        return result
+        
+    def cascade_report(self):
+        """Escalation rate and fast/full agreement on escalated images since the cascade was enabled"""
+        stats = self.cascade_stats
+        return {
+            'requests': stats['requests'],
+            'escalation_rate': stats['escalated'] / stats['requests'] if stats['requests'] else 0.0,
+            'escalated_agreement': stats['escalated_agreed'] / stats['escalated'] if stats['escalated'] else 1.0
+        }
+        
+    def evaluate_cascade(self, thresholds=(0.6, 0.7, 0.8, 0.9)):
+        """Compare the cascade against the full model on the test set for several thresholds"""
+        self.test_generator.reset()
+        batches = [self.test_generator[i][0] for i in range(len(self.test_generator))]
+        y_true = self.test_generator.classes
+        fast_size = tuple(self.fast_model.input_shape[1:3])
+        
+        # Run both models once and replay the cascade decision for every threshold
+        start = time.perf_counter()
+        full = np.concatenate([self.model.predict(b, verbose=0) for b in batches])
+        full_time = time.perf_counter() - start
+        start = time.perf_counter()
+        fast = np.concatenate([
+            self.fast_model.predict(tf.image.resize(b, fast_size).numpy(), verbose=0) for b in batches
+        ])
+        fast_time = time.perf_counter() - start
+        
+        full_pred = np.argmax(full, axis=1)
+        fast_pred = np.argmax(fast, axis=1)
+        print(f"Full model accuracy: {np.mean(full_pred == y_true):.4f}")
+        results = {}
+        for threshold in thresholds:
+            escalated = fast.max(axis=1) < threshold
+            cascade_pred = np.where(escalated, full_pred, fast_pred)
+            results[threshold] = {
+                'escalation_rate': float(escalated.mean()),
+                'accuracy': float(np.mean(cascade_pred == y_true)),
+                'agreement_with_full': float(np.mean(cascade_pred == full_pred)),
+                'relative_cost': (fast_time + escalated.mean() * full_time) / full_time
+            }
+            print(f"threshold {threshold:.2f}: escalated {results[threshold]['escalation_rate']:.1%}, "
+                  f"accuracy {results[threshold]['accuracy']:.4f}, "
+                  f"agreement {results[threshold]['agreement_with_full']:.4f}, "
+                  f"cost {results[threshold]['relative_cost']:.2f}x full")
+        return results
+        
+    def weights_digest(self, model=None, dtype=np.float32):
+        """SHA-256 over the shapes and values of a model's weights (the loaded model by default)
+
+        Values are cast to `dtype` first; float16 gives the same digest for a
+        model and its float16 artifact.
+        """
+        digest = hashlib.sha256()
+        for weight in (model or self.model).get_weights():
+            digest.update(str(weight.shape).encode())
+            digest.update(np.ascontiguousarray(weight, dtype=dtype).tobytes())
+        return digest.hexdigest()
+        
+    def backbone_digest(self):
+        """Identifies the backbone a head or index was built on, across H5, package and float16 artifact loads
+
+        Cached per backbone layer object, so serving pays for the hash once per
+        loaded model.
+        """
+        backbone = self.model.layers[0]
+        if self._backbone_digest is None or self._backbone_digest[0] is not backbone:
+            self._backbone_digest = (backbone, self.weights_digest(backbone, dtype=np.float16))
+        return self._backbone_digest[1]
+        
+    def build_variants(self, reduced_size=(160, 160), quantized_path='skin_disease_model_quant.tflite'):
+        """Build the servable model variants, most accurate first"""
+        if self.feature_extractor is not None:
+            # One backbone pass feeds the diagnosis head and every registered extra head
+            variants = [FunctionVariant('full', self._predict_all_heads, self.img_size)]
+        else:
+            variants = [KerasVariant('full', self.model, self.img_size)]
+        if self.fast_model is not None:
+            # The cascade is as accurate as the full model on the cases it escalates
+            variants[0] = FunctionVariant('cascade', self._predict_cascade_result, self.img_size)
+        
+        # Dynamic-range quantized copy (int8 weights), cached on disk per set of weights so a
+        # reloaded or updated model never serves a stale conversion
+        if quantized_path:
+            root, ext = os.path.splitext(quantized_path)
+            quantized_path = f"{root}-{self.weights_digest()[:16]}{ext}"
+            if not os.path.exists(quantized_path):
+                source = self.model if self.precision == 'float32' else with_precision(self.model, 'float32')
+                converter = tf.lite.TFLiteConverter.from_keras_model(source)
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+                with open(quantized_path, 'wb') as f:
+                    f.write(converter.convert())
+                print(f"Quantized model written to {quantized_path}")
+                # Conversions of earlier weights are never used again
+                directory = os.path.dirname(root) or '.'
+                prefix = os.path.basename(root) + '-'
+                for name in os.listdir(directory):
+                    path = os.path.join(directory, name)
+                    if name.startswith(prefix) and name.endswith(ext) and path != quantized_path:
+                        os.remove(path)
+            variants.append(TFLiteVariant('quantized', quantized_path, self.img_size))
+        
+        # Same weights at a lower input resolution; the backbone and pooling are size agnostic
+        if reduced_size:
+            reduced = self.create_network(img_size=reduced_size, weights=None)
+            reduced.set_weights(self.model.get_weights())
+            variants.append(KerasVariant(f'reduced-{reduced_size[0]}', reduced, reduced_size))
+        
+        if self.fast_model is not None:
+            variants.append(KerasVariant('fast', self.fast_model, self.fast_model.input_shape[1:3]))
+        
+        for variant in variants:
+            variant.warm_up()
+            print(f"Variant {variant.name}: {variant.latency * 1000:.0f} ms per image")
+        # Warm-up traffic should not count towards the cascade report
+        self.cascade_stats = {'requests': 0, 'escalated': 0, 'escalated_agreed': 0}
+        return variants
+        
+    def benchmark_precision(self, precisions=('float32', 'bfloat16'), train_steps=10, latency_runs=20):
+        """Compare training step time, inference latency and test accuracy per compute precision"""
+        results = {}
+        images, labels = self.train_generator[0]
+        for precision in precisions:
+            self.set_precision(precision)
+            model = with_precision(self.model, precision)
+            model.compile(
+                optimizer=optimizers.legacy.Adam(learning_rate=0.0001),
+                loss='categorical_crossentropy',
+                metrics=['accuracy']
+            )
+            
+            # Training steps on a copy, after one step to trace the graph
+            model.train_on_batch(images, labels)
+            start = time.perf_counter()
+            for _ in range(train_steps):
+                model.train_on_batch(images, labels)
+            step_time = (time.perf_counter() - start) / train_steps
+            
+            # Copy the weights back so accuracy is measured on the untouched model
+            model.set_weights(self.model.get_weights())
+            timings = []
+            for _ in range(latency_runs + 1):
+                start = time.perf_counter()
+                model(images[:1], training=False)
+                timings.append(time.perf_counter() - start)
+            _, accuracy = model.evaluate(self.test_generator, verbose=0)
+            
+            results[precision] = {
+                'train_step_ms': 1000 * step_time,
+                'latency_ms': 1000 * float(np.median(timings[1:])),
+                'test_accuracy': float(accuracy)
+            }
+            print(f"{precision}: train step {results[precision]['train_step_ms']:.0f} ms "
+                  f"(batch {len(images)}), latency {results[precision]['latency_ms']:.1f} ms/image, "
+                  f"test accuracy {accuracy:.4f}")
+        self.set_precision('float32')
+        return results
+        
+    def enable_load_adaptive(self, latency_slo=2.0, max_in_flight=1, **variant_kwargs):
+        """Serve each request from the most accurate variant that keeps the latency SLO"""
+        self.policy = LoadAdaptivePolicy(
+            self.build_variants(**variant_kwargs),
+            latency_slo=latency_slo,
+            max_in_flight=max_in_flight
+        )
+        
+    def predict_adaptive(self, img_array, queue_depth=0):
+        """Predict with the variant chosen for the current queue depth"""
+        if self.policy is None:
+            return {'probabilities': self.model.predict(img_array, verbose=0), 'variant': 'full'}
+        variant = self.policy.select(queue_depth)
+        result = variant.predict(img_array)
+        result['variant'] = variant.name
+        return result
+        
+    def evaluate_variants(self, variants=None):
+        """Measure accuracy and agreement with the full model for every variant"""
+        variants = variants or self.policy.variants
+        y_true = self.test_generator.classes
+        results = {}
+        reference = None
+        for variant in variants:
+            self.test_generator.reset()
+            start = time.perf_counter()
+            predictions = np.concatenate([
+                variant.predict(self.test_generator[i][0])['probabilities']
+                for i in range(len(self.test_generator))
+            ])
+            elapsed = time.perf_counter() - start
+            y_pred = np.argmax(predictions, axis=1)
+            if reference is None:
+                reference = y_pred
+            results[variant.name] = {
+                'accuracy': float(np.mean(y_pred == y_true)),
+                'agreement_with_full': float(np.mean(y_pred == reference)),
+                'ms_per_image': 1000 * elapsed / len(y_true)
+            }
+            print(f"{variant.name}: accuracy {results[variant.name]['accuracy']:.4f}, "
+                  f"agreement {results[variant.name]['agreement_with_full']:.4f}, "
+                  f"{results[variant.name]['ms_per_image']:.1f} ms/image")
+        return results
+
+def distill_student(args):
+    """Distill the trained model into a lightweight student and export it"""
+    print("=== Skin Disease Model Distillation ===")
+    
+    detector = SkinDiseaseDetector()
+    detector.get_class_names()
+    detector.create_data_generators(batch_size=args.batch_size)
+    
+    teacher = detector.distill(
+        teacher_path=args.teacher,
+        architecture=args.student,
+        epochs=args.epochs,
+        batch_size=args.batch_size,
+        temperature=args.temperature,
+        alpha=args.alpha
+    )
+    detector.compare_with_teacher(teacher)
+    detector.save_model(args.output)
+
+def build_index(args):
+    """Embed the training set for similar-case retrieval"""
+    detector = SkinDiseaseDetector()
+    detector.get_class_names()
+    if args.model == 'imagenet':
+        # Features of the frozen pre-trained backbone, as seen by the head during training
+        detector.model = detector.create_network()
+    else:
+        detector.load_model(args.model)
+    detector.build_embedding_index(args.output, batch_size=args.batch_size, nlist=args.nlist)
+
+def add_classes(args):
+    """Retrain the head for an updated class_names.txt without touching the backbone"""
+    detector = SkinDiseaseDetector()
+    detector.get_class_names()
+    detector.load_model(args.model)
+    detector.update_classes(
+        index_dir=args.index,
+        head_path=args.head_output,
+        epochs=args.epochs,
+        batch_size=args.batch_size
+    )
+    if args.save_full:
+        detector.save_model(args.save_full)
+
+def evaluate_serving(args):
+    """Measure accuracy/cost trade-offs of the optional inference modes on the test set"""
+    detector = SkinDiseaseDetector()
+    detector.get_class_names()
+    detector.create_data_generators(batch_size=32)
+    detector.load_model(args.model)
+    if args.mode == 'tta':
+        detector.evaluate_tta()
+    elif args.mode == 'uncertainty':
+        detector.evaluate_uncertainty()
+    elif args.mode == 'cascade':
+        detector.enable_cascade(args.fast_model)
+        detector.evaluate_cascade()
+    elif args.mode == 'variants':
+        detector.evaluate_variants(detector.build_variants())
+    elif args.mode == 'precision':
+        detector.benchmark_precision()
+
+def check_augmentation(args):
+    """Check that the in-graph augmentation reproduces ImageDataGenerator's; exits non-zero if not"""
+    detector = SkinDiseaseDetector()
+    detector.create_data_generators(batch_size=32)
+    passed = detector.check_augmentation_parity(samples=args.samples, repeats=args.repeats, seed=args.seed)
+    sys.exit(0 if passed else 1)
+
+def launch_local_workers(num_workers, worker_args):
+    """Run a multi-worker training job as local processes, each with its own TF_CONFIG"""
+    # Reserve a free port per worker
+    sockets = [socket.socket() for _ in range(num_workers)]
+    for sock in sockets:
+        sock.bind(('localhost', 0))
+    addresses = [f"localhost:{sock.getsockname()[1]}" for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    
+    processes = []
+    for index in range(num_workers):
+        tf_config = {'cluster': {'worker': addresses}, 'task': {'type': 'worker', 'index': index}}
+        env = dict(os.environ, TF_CONFIG=json.dumps(tf_config))
+        processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), *worker_args], env=env))
+    print(f"Started {num_workers} local workers on {', '.join(addresses)}")
+    return max([process.wait() for process in processes])
+
+def report_training_run(mode, seconds, test_accuracy, config=None, path='training_runs.json'):
+    """Append a run's wall time and test accuracy to `path` and compare it with the last baseline run
+
+    Only a baseline run with the same `config` (precision, batch, epochs,
+    hardware layout and so on) counts, so the difference comes from `mode` alone.
+    """
+    config = config or {}
+    runs = []
+    if os.path.exists(path):
+        with open(path) as f:
+            runs = json.load(f)
+    baseline = next((run for run in reversed(runs)
+                     if run['mode'] == 'baseline' and run.get('config') == config), None)
+    runs.append({'mode': mode, 'config': config, 'seconds': seconds, 'test_accuracy': test_accuracy,
+                 'finished': time.strftime('%Y-%m-%d %H:%M:%S')})
+    with open(path, 'w') as f:
+        json.dump(runs, f, indent=2)
+    
+    print(f"{mode} training took {seconds / 60:.1f} min, test accuracy {test_accuracy:.4f}")
+    if mode == 'baseline':
+        return
+    if baseline is None:
+        print(f"No baseline run with the same configuration in {path} to compare with")
+    else:
+        print(f"Baseline: {baseline['seconds'] / 60:.1f} min, test accuracy {baseline['test_accuracy']:.4f} "
+              f"-> {baseline['seconds'] / seconds:.2f}x faster, "
+              f"accuracy {test_accuracy - baseline['test_accuracy']:+.4f}")
+
+def train(args):
+    """Train and evaluate the model"""
+    # Start the clock before anything slow so the budget covers the whole run
+    deadline = time.time() + 60 * args.time_budget if args.time_budget else None
+    if deadline and (args.distributed or args.local_workers > 1):
+        # Workers would each decide to stop at a different step and deadlock
+        raise ValueError("--time-budget is not supported for distributed training")
+    if args.accumulate_steps > 1 and (args.distributed or args.local_workers > 1):
+        raise ValueError("--accumulate-steps is not supported for distributed training")
+    if args.progressive and (args.distributed or args.local_workers > 1 or args.resume or deadline):
+        raise ValueError("--progressive trains in a single process without checkpoint resume")
+    if args.progressive and args.graph_augmentation:
+        raise ValueError("--progressive builds its own per-stage generators; drop --graph-augmentation")
+    
+    if args.local_workers > 1:
+        worker_args = ['train', '--distributed', 'multi-worker', '--epochs', str(args.epochs),
+                       '--checkpoint-dir', args.checkpoint_dir]
+        if args.batch_size:
+            worker_args += ['--batch-size', str(args.batch_size)]
+        if args.hparams:
+            worker_args += ['--hparams', args.hparams]
+        if args.resume:
+            worker_args.append('--resume')
+        if args.graph_augmentation:
+            worker_args.append('--graph-augmentation')
+        worker_args += ['--precision', args.precision]
+        sys.exit(launch_local_workers(args.local_workers, worker_args))
+    
     print("=== Skin Disease Detection Model ===")
     
     # Initialize the detector
     detector = SkinDiseaseDetector()
+    if args.distributed:
+        # The strategy has to exist before any other TensorFlow op runs
+        detector.enable_distributed(args.distributed)
+    
+    if args.precision != 'float32':
+        detector.set_precision(args.precision)
+    
+    detector.accumulate_steps = args.accumulate_steps
+    detector.graph_augmentation = args.graph_augmentation
     
     # Get class names
     detector.get_class_names()
+    if args.hparams:
+        detector.load_hparams(args.hparams)
+    batch_size = args.batch_size or detector.hparams['batch_size']
     
     # Create data generators
-    detector.create_data_generators(batch_size=32)
+    detector.create_data_generators(batch_size=batch_size)
+    if detector.strategy is not None:
+        detector.create_distributed_datasets(batch_size=batch_size)
+    elif detector.graph_augmentation:
+        detector.create_graph_datasets(batch_size=batch_size)
     
     # Build model
-    detector.build_model()
+    detector.build_model(flexible=args.progressive)
     
     # Train model
-    detector.train_model(epochs=30)
+    start = time.perf_counter()
+    if args.progressive:
+        detector.train_progressive(epochs=args.epochs, batch_size=batch_size, telemetry_path=args.telemetry)
+    else:
+        detector.train_model(epochs=args.epochs, checkpoint_dir=args.checkpoint_dir,
+                             resume=args.resume, deadline=deadline,
+                             profile_dir=args.profile, trace_steps=args.trace_steps,
+                             telemetry_path=args.telemetry)
+    train_seconds = time.perf_counter() - start
+    if detector.telemetry is not None:
+        detector.telemetry.end_run(stopped=detector.budget_exhausted)
+    if detector.budget_exhausted:
+        print(f"Stopped before the time budget ran out; continue with --resume "
+              f"(checkpoints in {args.checkpoint_dir})")
+        return
+    detector.finish_distributed()
+    if not detector.is_chief:
+        return
     
     # Evaluate model
     test_accuracy, y_pred, y_true = detector.evaluate_model()
+    if not args.resume:
+        config = {
+            'epochs': args.epochs,
+            'batch_size': batch_size,
+            'precision': args.precision,
+            'accumulate_steps': args.accumulate_steps,
+            'graph_augmentation': args.graph_augmentation,
+            'distributed': args.distributed,
+            'replicas': detector.strategy.num_replicas_in_sync if detector.strategy is not None else 1,
+            'profile': bool(args.profile),
+            'hparams': detector.hparams
+        }
+        report_training_run('progressive' if args.progressive else 'baseline', train_seconds, test_accuracy,
+                            config)
     
     # Plot results
     detector.plot_training_history()
@@ -310,5 +2205,97 @@ def main():
     print(f"\nFinal Test Accuracy: {test_accuracy:.4f}")
     print("Training completed successfully!")
 
+def main():
+    """Main function to train and evaluate the model"""
+    parser = argparse.ArgumentParser(description="Skin disease model training tools")
+    subparsers = parser.add_subparsers(dest='command')
+    train_parser = subparsers.add_parser('train', help="Train the full model (default)")
+    train_parser.add_argument('--epochs', type=int, default=30)
+    train_parser.add_argument('--batch-size', type=int, default=None,
+                              help="Batch size per replica (default 32 or the --hparams value); "
+                                   "the global batch grows with the cluster")
+    train_parser.add_argument('--hparams', default=None,
+                              help="JSON file of hyperparameters, e.g. written by hparam_search.py")
+    train_parser.add_argument('--distributed', choices=['mirrored', 'multi-worker'], default=None,
+                              help="Train under a tf.distribute strategy (multi-worker reads TF_CONFIG)")
+    train_parser.add_argument('--local-workers', type=int, default=1,
+                              help="Launch this many multi-worker processes on this machine")
+    train_parser.add_argument('--checkpoint-dir', default='training_checkpoints',
+                              help="Where full training-state checkpoints are written every epoch")
+    train_parser.add_argument('--resume', action='store_true',
+                              help="Continue from the latest checkpoint in --checkpoint-dir")
+    train_parser.add_argument('--time-budget', type=float, default=None,
+                              help="Wall-clock minutes; stop and checkpoint before they run out")
+    train_parser.add_argument('--accumulate-steps', type=int, default=1,
+                              help="Average gradients over this many batches per update "
+                                   "(effective batch = batch size x steps)")
+    train_parser.add_argument('--precision', choices=sorted(PRECISION_POLICIES), default='float32',
+                              help="bfloat16 computes in mixed bfloat16 (AVX-512 BF16 / AMX CPUs)")
+    train_parser.add_argument('--graph-augmentation', action='store_true',
+                              help="Augment whole batches in the tf.data graph instead of with ImageDataGenerator")
+    train_parser.add_argument('--progressive', action='store_true',
+                              help="Start at small image sizes and grow to full size (PROGRESSIVE_STAGES)")
+    train_parser.add_argument('--telemetry', default='training_telemetry.jsonl',
+                              help="Append live metrics here for the app's Training Monitor ('' disables)")
+    train_parser.add_argument('--profile', nargs='?', const='training_profile', default=None,
+                              help="Record input-wait vs. compute time per step into this directory")
+    train_parser.add_argument('--trace-steps', type=int, nargs=2, default=None, metavar=('FIRST', 'LAST'),
+                              help="With --profile, also capture a TensorFlow profiler trace of these batches")
+    
+    distill_parser = subparsers.add_parser('distill', help="Distill the trained model into a small student")
+    distill_parser.add_argument('--teacher', default='skin_disease_model.h5')
+    distill_parser.add_argument('--student', default='mobilenetv3small', choices=sorted(STUDENT_BACKBONES))
+    distill_parser.add_argument('--output', default='skin_disease_student.h5')
+    distill_parser.add_argument('--epochs', type=int, default=30)
+    distill_parser.add_argument('--batch-size', type=int, default=32)
+    distill_parser.add_argument('--temperature', type=float, default=4.0)
+    distill_parser.add_argument('--alpha', type=float, default=0.3,
+                                help="Weight of the hard-label loss against the teacher loss")
+    
+    index_parser = subparsers.add_parser('index', help="Build the similar-case embedding index")
+    index_parser.add_argument('--model', default='skin_disease_model.h5',
+                              help="Trained model, or 'imagenet' for the untrained pre-trained backbone")
+    index_parser.add_argument('--output', default='embeddings')
+    index_parser.add_argument('--batch-size', type=int, default=64)
+    index_parser.add_argument('--nlist', type=int, default=0,
+                              help="Number of IVF lists for approximate search (0 = exact search)")
+    
+    classes_parser = subparsers.add_parser('add-classes',
+                                           help="Retrain only the head after editing class_names.txt")
+    classes_parser.add_argument('--model', default='skin_disease_model.h5')
+    classes_parser.add_argument('--index', default='embeddings')
+    classes_parser.add_argument('--head-output', default='skin_disease_head.h5')
+    classes_parser.add_argument('--epochs', type=int, default=50)
+    classes_parser.add_argument('--batch-size', type=int, default=64)
+    classes_parser.add_argument('--save-full', default=None,
+                                help="Also write the complete updated model to this path")
+    
+    evaluate_parser = subparsers.add_parser('evaluate', help="Evaluate an optional inference mode")
+    evaluate_parser.add_argument('mode', choices=['tta', 'uncertainty', 'cascade', 'variants', 'precision'])
+    evaluate_parser.add_argument('--model', default='skin_disease_model.h5')
+    evaluate_parser.add_argument('--fast-model', default='skin_disease_student.h5')
+    
+    augmentation_parser = subparsers.add_parser('check-augmentation',
+                                                help="Compare --graph-augmentation with ImageDataGenerator")
+    augmentation_parser.add_argument('--samples', type=int, default=32, help="Training images to compare on")
+    augmentation_parser.add_argument('--repeats', type=int, default=20, help="Random draws per image")
+    augmentation_parser.add_argument('--seed', type=int, default=0)
+    
+    args = parser.parse_args()
+    if args.command is None:
+        args = parser.parse_args(['train'])
+    if args.command == 'distill':
+        distill_student(args)
+    elif args.command == 'index':
+        build_index(args)
+    elif args.command == 'add-classes':
+        add_classes(args)
+    elif args.command == 'evaluate':
+        evaluate_serving(args)
+    elif args.command == 'check-augmentation':
+        check_augmentation(args)
+    else:
+        train(args)
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file
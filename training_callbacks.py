@@ -0,0 +1,416 @@
+import os
+import json
+import time
+from collections import deque
+import numpy as np
+import tensorflow as tf
+
+# Attributes of the built-in callbacks that carry state from one epoch to the next
+CALLBACK_STATE = ('wait', 'best', 'best_epoch', 'cooldown_counter')
+
+
+def host_memory_mb():
+    """Resident memory of this process in MB (peak resident memory where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def read_progress(directory):
+    """(phase, epoch, step) of the latest full-state checkpoint in `directory`, or None"""
+    path = tf.train.latest_checkpoint(directory)
+    if path is None:
+        return None
+    reader = tf.train.load_checkpoint(path)
+    return tuple(int(reader.get_tensor(f'{name}/.ATTRIBUTES/VARIABLE_VALUE'))
+                 for name in ('phase', 'epoch', 'step'))
+
+
+def merge_histories(histories):
+    """Join the History objects of consecutive fit() calls into the last one"""
+    merged = histories[-1]
+    for history in reversed(histories[:-1]):
+        for key, values in history.history.items():
+            merged.history[key] = values + merged.history.get(key, [])
+        merged.epoch = history.epoch + merged.epoch
+    return merged
+
+
+class EpochRemainder(tf.keras.utils.Sequence):
+    """The batches of an interrupted epoch that had not been trained on yet"""
+
+    def __init__(self, sequence, start):
+        self.sequence = sequence
+        self.start = start
+
+    def __len__(self):
+        return len(self.sequence) - self.start
+
+    def __getitem__(self, idx):
+        return self.sequence[self.start + idx]
+
+    def on_epoch_end(self):
+        self.sequence.on_epoch_end()
+
+
+class TimedSequence(tf.keras.utils.Sequence):
+    """Pass batches through unchanged, telling a StepProfiler when each one finished loading"""
+
+    def __init__(self, sequence, profiler):
+        self.sequence = sequence
+        self.profiler = profiler
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def __getitem__(self, idx):
+        batch = self.sequence[idx]
+        self.profiler.record_load(time.perf_counter(), len(batch[0]))
+        return batch
+
+    def on_epoch_end(self):
+        self.sequence.on_epoch_end()
+
+
+class StepProfiler(tf.keras.callbacks.Callback):
+    """Per-step input-wait and compute time, throughput and host memory, summarized per phase
+
+    Training batches must come through a TimedSequence. A step whose batch
+    finished loading after the step began spent the difference waiting for
+    input and the rest of the step computing; without a TimedSequence (the
+    distributed datasets) every step counts as compute. `trace_steps=(first,
+    last)` also captures a TensorFlow profiler trace of those batches of the
+    first epoch into `log_dir`. Steps of all fit() calls between begin_phase()
+    and end_phase() are summarized together; with `append` (a resumed run)
+    they are added to the phase's existing CSV instead of replacing it.
+    """
+
+    def __init__(self, log_dir='training_profile', trace_steps=None, append=False):
+        super().__init__()
+        self.log_dir = log_dir
+        self.trace_steps = trace_steps
+        self.append = append
+        self.phase = 0
+        self.loads = deque()
+        self.steps = []
+        self._start = time.perf_counter()
+        self._tracing = False
+        self._traced = False
+        os.makedirs(log_dir, exist_ok=True)
+
+    def record_load(self, end, size):
+        self.loads.append((end, size))
+
+    def begin_phase(self, phase):
+        self.phase = phase
+        self.steps = []
+        self._start = time.perf_counter()
+
+    def on_train_begin(self, logs=None):
+        self.loads.clear()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.trace_steps and not self._traced and batch == self.trace_steps[0]:
+            tf.profiler.experimental.start(self.log_dir)
+            self._tracing = True
+        self._begin = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        end = time.perf_counter()
+        load_end, size = self.loads.popleft() if self.loads else (self._begin, 0)
+        wait = min(max(0.0, load_end - self._begin), end - self._begin)
+        self.steps.append((self.epoch, batch, wait, end - self._begin - wait, size, host_memory_mb()))
+        if self._tracing and batch >= self.trace_steps[1]:
+            tf.profiler.experimental.stop()
+            self._tracing = False
+            self._traced = True
+
+    def on_train_end(self, logs=None):
+        if self._tracing:
+            tf.profiler.experimental.stop()
+            self._tracing = False
+            self._traced = True
+
+    def end_phase(self):
+        """Print the phase summary and write its steps to steps-phase{N}.csv"""
+        if not self.steps:
+            return
+        steps = np.array(self.steps, dtype=np.float64)
+        wait, compute = steps[:, 2].sum(), steps[:, 3].sum()
+        busy = wait + compute
+        images = steps[:, 4].sum()
+        share = wait / busy if busy else 0.0
+        if share > 0.3:
+            verdict = "input-bound: speed up image decoding and augmentation first"
+        elif share < 0.1:
+            verdict = "compute-bound: the model itself dominates step time"
+        else:
+            verdict = "mixed: both input and compute take a noticeable share"
+
+        summary = [
+            f"Phase {self.phase}: {len(steps)} steps in {time.perf_counter() - self._start:.1f}s",
+            f"  input wait  {wait:.1f}s ({100 * share:.0f}% of step time, "
+            f"median {1000 * np.median(steps[:, 2]):.1f} ms/step)",
+            f"  compute     {compute:.1f}s (median {1000 * np.median(steps[:, 3]):.1f} ms/step)",
+            f"  throughput  {images / busy if busy and images else float('nan'):.1f} images/s",
+            f"  host memory {steps[:, 5].max():.0f} MB peak",
+            f"  verdict     {verdict}"
+        ]
+        print("\n" + "\n".join(summary))
+        path = os.path.join(self.log_dir, f'steps-phase{self.phase}.csv')
+        fresh = not (self.append and os.path.exists(path))
+        with open(path, 'w' if fresh else 'a') as f:
+            np.savetxt(f, steps, delimiter=',', fmt=['%d', '%d', '%.6f', '%.6f', '%d', '%.1f'],
+                       header='epoch,batch,input_wait_s,compute_s,images,host_memory_mb' if fresh else '',
+                       comments='')
+        with open(os.path.join(self.log_dir, 'summary.txt'), 'a') as f:
+            f.write("\n".join(summary) + "\n\n")
+
+
+class TelemetryLogger(tf.keras.callbacks.Callback):
+    """Append batch and epoch metrics to a JSON-lines file that a viewer can tail during training
+
+    Records are buffered in memory and written at most every `flush_seconds`
+    and at the end of each epoch, so the training loop never waits on the disk.
+    Every `batch_every`-th batch is recorded. The learning rate is read from
+    the optimizer, so reductions by ReduceLROnPlateau show up as they happen.
+    """
+
+    def __init__(self, path='training_telemetry.jsonl', batch_size=None, batch_every=10, flush_seconds=5.0):
+        super().__init__()
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_every = batch_every
+        self.flush_seconds = flush_seconds
+        self.phase = 0
+        self.steps = 0
+        self.buffer = []
+        self._started = False
+        self._last_flush = time.time()
+
+    def _record(self, logs=None, **record):
+        record.update({key: float(value) for key, value in (logs or {}).items()})
+        record['lr'] = float(tf.keras.backend.get_value(self.model.optimizer.lr))
+        record['time'] = time.time()
+        self.buffer.append(json.dumps(record))
+        if record['time'] - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def _throughput(self, batches, seconds):
+        if not self.batch_size or seconds <= 0:
+            return None
+        return batches * self.batch_size / seconds
+
+    def flush(self):
+        if self.buffer:
+            with open(self.path, 'a') as f:
+                f.write("\n".join(self.buffer) + "\n")
+            self.buffer = []
+        self._last_flush = time.time()
+
+    def on_train_begin(self, logs=None):
+        if not self._started:
+            self._started = True
+            self._record(type='start', run=time.strftime('%Y-%m-%d %H:%M:%S'))
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+        self._epoch_start = self._window_start = time.perf_counter()
+        self._epoch_batches = self._window_batches = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.steps += 1
+        self._epoch_batches += 1
+        self._window_batches += 1
+        if batch % self.batch_every:
+            return
+        now = time.perf_counter()
+        self._record(logs, type='batch', phase=self.phase, epoch=self.epoch, batch=batch, step=self.steps,
+                     images_per_sec=self._throughput(self._window_batches, now - self._window_start))
+        self._window_start = now
+        self._window_batches = 0
+
+    def on_epoch_end(self, epoch, logs=None):
+        seconds = time.perf_counter() - self._epoch_start
+        self._record(logs, type='epoch', phase=self.phase, epoch=epoch, step=self.steps, seconds=seconds,
+                     images_per_sec=self._throughput(self._epoch_batches, seconds))
+        self.flush()
+
+    def on_train_end(self, logs=None):
+        # Runs after every fit() call, including each progressive stage; end_run() marks the run's end
+        self.flush()
+
+    def end_run(self, stopped=False):
+        """Record that the whole run is over; `stopped` when it ended early to be resumed"""
+        self._record(type='run_end', phase=self.phase, stopped=stopped)
+        self.flush()
+
+
+class CarryState(tf.keras.callbacks.Callback):
+    """Keep the counters of stateful callbacks across consecutive fit() calls
+
+    fit() resets EarlyStopping and ReduceLROnPlateau when it begins, so their
+    patience would only count epochs of one fit(). This puts back what they
+    held when the previous fit() ended, including EarlyStopping's best
+    weights. It must come after them in the callback list.
+    """
+
+    def __init__(self, callbacks):
+        super().__init__()
+        self.callbacks = list(callbacks)
+        self.saved = None
+
+    def on_train_begin(self, logs=None):
+        if self.saved is None:
+            return
+        for callback, state in zip(self.callbacks, self.saved):
+            for attr, value in state.items():
+                setattr(callback, attr, value)
+
+    def on_train_end(self, logs=None):
+        self.saved = [
+            {attr: getattr(callback, attr) for attr in CALLBACK_STATE + ('best_weights',)
+             if hasattr(callback, attr)}
+            for callback in self.callbacks
+        ]
+
+
+class ResumableCheckpoint(tf.keras.callbacks.Callback):
+    """Full training-state checkpoints written asynchronously, with an optional wall-clock deadline
+
+    Every checkpoint holds the model, the optimizer (including any learning rate
+    ReduceLROnPlateau lowered), the training phase, the epoch, the number of
+    batches of that epoch already trained with the sample order they were drawn
+    in, and the counters of the stateful callbacks. Saves run in a background
+    thread, so the next step does not wait for the write. With `deadline` (a
+    time.time() value) training stops at a batch boundary early enough to
+    validate and write one last checkpoint. The in-memory best weights of
+    EarlyStopping are not part of the state.
+    """
+
+    def __init__(self, directory, callbacks=(), write_directory=None, max_to_keep=3,
+                 deadline=None, save_seconds=60.0):
+        super().__init__()
+        self.directory = directory
+        # Non-chief workers of a distributed job write to a directory of their own
+        self.write_directory = write_directory or directory
+        self.callbacks = list(callbacks)
+        self.max_to_keep = max_to_keep
+        self.deadline = deadline
+        self.save_seconds = save_seconds
+        self.options = tf.train.CheckpointOptions(experimental_enable_async_checkpoint=True)
+        self.phase = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.step = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.order = tf.Variable(tf.zeros([0], tf.int64), shape=tf.TensorShape([None]), trainable=False)
+        self.state = {
+            f'{i}_{attr}': tf.Variable(0.0, dtype=tf.float64, trainable=False)
+            for i, callback in enumerate(self.callbacks)
+            for attr in CALLBACK_STATE if hasattr(callback, attr)
+        }
+        self.sequence = None
+        self.batch_offset = 0
+        self.carry_state = False
+        self.stopped = False
+        self.step_time = None
+        self.validation_time = 0.0
+
+    def begin_phase(self, phase, model, sequence=None):
+        """Track `model` and its current optimizer for a new training phase
+
+        `sequence` is the Keras iterator whose sample order is saved with each
+        checkpoint so a mid-epoch resume continues with the same batches.
+        """
+        self.phase.assign(phase)
+        self.sequence = sequence
+        self.carry_state = False
+        self.checkpoint = tf.train.Checkpoint(
+            model=model, optimizer=model.optimizer, phase=self.phase, epoch=self.epoch,
+            step=self.step, order=self.order, **self.state
+        )
+        self.manager = tf.train.CheckpointManager(self.checkpoint, self.write_directory,
+                                                  max_to_keep=self.max_to_keep)
+
+    def restore(self):
+        """Load the latest checkpoint of the current phase; returns (epoch, step)"""
+        path = tf.train.latest_checkpoint(self.directory)
+        phase, epoch, step = read_progress(self.directory)
+        if epoch == 0 and step == 0:
+            # Written when the previous phase ended; the optimizer there belongs to that phase
+            tf.train.Checkpoint(model=self.checkpoint.model).restore(path).expect_partial()
+        else:
+            self.checkpoint.restore(path)
+            self.carry_state = True
+            if step > 0 and self.sequence is not None:
+                self.sequence.index_array = self.order.numpy()
+        print(f"Resumed phase {phase} at epoch {epoch + 1}, batch {step} from {path}")
+        return epoch, step
+
+    def save(self, epoch, step):
+        self.epoch.assign(epoch)
+        self.step.assign(step)
+        if step > 0 and self.sequence is not None:
+            self.order.assign(self.sequence.index_array.astype(np.int64))
+        for i, callback in enumerate(self.callbacks):
+            for attr in CALLBACK_STATE:
+                if f'{i}_{attr}' in self.state:
+                    self.state[f'{i}_{attr}'].assign(float(getattr(callback, attr)))
+        self.manager.save(options=self.options)
+
+    def end_phase(self):
+        """Record that the current phase finished so a resume starts the next one"""
+        self.phase.assign_add(1)
+        self.save(0, 0)
+        self.checkpoint.sync()
+
+    def on_train_begin(self, logs=None):
+        # fit() resets the other callbacks; put back what the checkpoint restored
+        self.stopped = False
+        if not self.carry_state:
+            return
+        for i, callback in enumerate(self.callbacks):
+            for attr in CALLBACK_STATE:
+                if f'{i}_{attr}' in self.state:
+                    value = self.state[f'{i}_{attr}'].numpy()
+                    setattr(callback, attr, int(value) if attr != 'best' else value)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.steps_done = self.batch_offset
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._batch_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        elapsed = time.perf_counter() - self._batch_start
+        self.step_time = elapsed if self.step_time is None else 0.9 * self.step_time + 0.1 * elapsed
+        self.steps_done = self.batch_offset + batch + 1
+        if self.deadline is None:
+            return
+        # Leave room for two more steps, the validation pass and the final save
+        needed = 2 * self.step_time + self.validation_time + self.save_seconds
+        if time.time() + needed >= self.deadline:
+            print(f"\nTime budget almost used up; stopping after batch {self.steps_done}")
+            self.stopped = True
+            self.model.stop_training = True
+
+    def on_test_begin(self, logs=None):
+        self._test_start = time.perf_counter()
+
+    def on_test_end(self, logs=None):
+        self.validation_time = time.perf_counter() - self._test_start
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.stopped and self.sequence is not None and self.steps_done < len(self.sequence):
+            self.save(epoch, self.steps_done)
+        else:
+            self.save(epoch + 1, 0)
+        self.carry_state = True
+
+    def on_train_end(self, logs=None):
+        self.checkpoint.sync()